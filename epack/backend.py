@@ -17,29 +17,51 @@
 
 from __future__ import absolute_import, print_function, unicode_literals
 
-backends = []
+import importlib
 
-try:
-    from epack.backend_libarchive import LibarchiveBackend
-    backends.append(LibarchiveBackend)
-except Exception as e:
-    print('%s - Libarchive backend disabled' % e)
+from epack.probe import probe
 
-try:
-    from epack.backend_shell import ShellBackend
-    backends.append(ShellBackend)
-except Exception as e:
-    print('%s - Shell backend disabled' % e)
+
+# (module, class) of the backends, in order of preference. They are only
+# imported when the first archive is opened.
+BACKENDS = (
+    ('epack.backend_libarchive', 'LibarchiveBackend'),
+    ('epack.backend_shell', 'ShellBackend'),
+)
+
+_backends = None
+
+
+def available_backends():
+    """ The classes of the backends that can be imported """
+    global _backends
+    if _backends is None:
+        found = []  # published when complete, other threads may be here
+        for module_name, class_name in BACKENDS:
+            try:
+                module = importlib.import_module(module_name)
+                found.append(getattr(module, class_name))
+            except Exception as e:
+                print('%s - %s disabled' % (e, class_name))
+        _backends = found
+    return _backends
 
 
 def load_backend(fname):
-    instance = None
+    """ An instance of the first backend able to read fname, or None.
+        The file is probed once, all the backends decide on the same
+        Probe (see epack.probe).
+    """
+    try:
+        info = probe(fname)
+    except EnvironmentError as e:
+        print('Cannot read %s: %s' % (fname, e))
+        return None
 
-    for backend in backends:
+    for backend in available_backends():
         try:
-            instance = backend(fname)
-            break
+            return backend(fname, info)
         except Exception as e:
             print('%s: %s' % (backend.name, e))
 
-    return instance
+    return None
@@ -18,13 +18,28 @@
 from __future__ import absolute_import, print_function, unicode_literals
 
 import os
+import time
 import threading
+from contextlib import contextmanager
 try:
     from queue import Queue # py3
 except:
     from Queue import Queue # py2
 
-from efl import ecore
+from epack import seekindex
+from epack.dirtree import DirTree
+from epack.extractor import Extractor, ENGINE_PYTHON
+from epack.listcache import ListCache
+from epack.matcher import PathMatcher
+from epack.probe import probe
+from epack.progress import Progress, DEFAULT_INTERVAL
+from epack.writer import SYNC_NONE
+
+
+# the listing is sent to the UI in batches of at most LIST_BATCH_SIZE
+# entries, or every LIST_BATCH_INTERVAL seconds if the reading is slow
+LIST_BATCH_SIZE = 1000
+LIST_BATCH_INTERVAL = 0.05
 
 
 class LibarchiveBackend(object):
@@ -36,37 +51,208 @@ class LibarchiveBackend(object):
     """
     name = "Libarchive"
 
-    def __init__(self, archive_file):
+    def __init__(self, archive_file, info=None):
         import epack.libarchive
 
         self.libarchive = epack.libarchive
 
-        # check if we can really open the archive (raise exception on fail)
-        with self.libarchive.file_reader(archive_file) as archive:
-            pass
+        # all the formats the probe know are supported, check the others
+        # really opening the archive (raise exception on fail): a known
+        # compression filter tells nothing of what it compresses
+        if info is None:
+            info = probe(archive_file)
+        if info.format is None:
+            with self.libarchive.file_reader(archive_file) as archive:
+                pass
 
         self._queue = Queue()
-        self._total_size = 0
+        self._tree = None  # the last complete listing
+        self.stats = {}    # of the last extraction, see Extractor.stats
+        self.progress = Progress()
+        self.progress_interval = DEFAULT_INTERVAL
         self._stoprequest = threading.Event()
         self._thread = None
+        self.cache = ListCache()
+
+    def list_content(self, archive_file, done_cb, batch_cb=None):
+        """ List the archive in a thread, done_cb receive the complete
+            DirTree at the end (also when aborted).
+
+            While reading, batch_cb(tree, nodes) is called with the tree
+            filled so far and the new topmost nodes of each batch. A listing
+            found in the cache is given to done_cb at once, with no batches.
+        """
+        from efl import ecore  # only the *_sync methods work without efl
 
-    def list_content(self, archive_file, done_cb):
         self._cleanup()
-        ecore.Timer(0.1, self._check_list_queue, done_cb)
+        queue = Queue()  # not shared, an aborted listing can still drain
+        ecore.Timer(LIST_BATCH_INTERVAL, self._check_list_queue,
+                    archive_file, queue, done_cb, batch_cb, DirTree())
         self._thread = threading.Thread(target=self._list_in_a_thread,
-                                        args=(archive_file,))
+                                        args=(archive_file, queue))
         self._thread.start()
 
-    def extract(self, archive_file, destination, progress_cb, done_cb):
+    def list_sync(self, archive_file):
+        """ List in the calling thread, return the complete DirTree (partial
+            if aborted)
+        """
+        queue = Queue()
+        self._list_in_a_thread(archive_file, queue)
+        tree, done = self._drain_list_queue(archive_file, queue, DirTree())
+        return tree
+
+    def extract(self, archive_file, destination, progress_cb, done_cb,
+                list_cb=None, batch_cb=None, **options):
+        """ Extract in a thread, see extract_sync() for the options.
+
+            If list_cb is given the archive is listed while extracting, in a
+            single pass, and list_cb receive the listing (a DirTree) just
+            before done_cb. No previous list_content() is needed in this case.
+            Meanwhile batch_cb(tree, nodes) is called as in list_content().
+        """
+        from efl import ecore
+
         self._cleanup()
-        ecore.Timer(0.1, self._check_extract_queue, progress_cb, done_cb)
+        if list_cb is not None:
+            # filled here, in the main thread, with the batches sent by
+            # the extraction
+            listing = _QueuedListing(Queue())
+            tree = DirTree()
+        else:
+            listing = tree = None
+        ecore.Timer(self.progress_interval, self._check_extract_queue,
+                    archive_file, progress_cb, done_cb, list_cb, batch_cb,
+                    listing, tree)
         self._thread = threading.Thread(target=self._extract_in_a_thread,
-                                        args=(archive_file, destination))
+                                        args=(archive_file, destination,
+                                              listing, options))
         self._thread.start()
 
+    def extract_sync(self, archive_file, destination, engine=ENGINE_PYTHON,
+                     flags=None, include=None, exclude=None, jobs=1,
+                     same_owner=False, detect_holes=False, sync=SYNC_NONE,
+                     pipeline=False, dedupe=False, incremental=False,
+                     verify=False, delete=False, journal=False, resume=False,
+                     listing=None):
+        """ Extract in the calling thread, return 'success', 'stopped' or
+            the error message. Progress can be followed in self.progress.
+
+            engine can be ENGINE_PYTHON or ENGINE_DISK, flags are the
+            archive_write_disk options used by the latter (see
+            epack.libarchive.parse_flags)
+
+            include and exclude are lists of patterns (see PathMatcher) to
+            extract only some of the entries, the data of the others is
+            skipped without writing it.
+
+            With jobs != 1 seekable archives are extracted by many
+            processes (0 means one per cpu), see ParallelExtractor.
+
+            same_owner restore the owner of the files (python engine,
+            usually only allowed to root).
+
+            detect_holes leave the runs of zeros of the files as holes (not
+            allocated), as the holes of the sparse entries always are.
+
+            sync is the durability policy, see epack.writer: SYNC_NONE,
+            SYNC_FILE (python engine only) or SYNC_END.
+
+            pipeline write the files in another thread while decoding
+            (python engine), see epack.pipeline.
+
+            dedupe turn the files identical to one already extracted into
+            reflinks or hard links of it (python engine, in a single
+            process), see epack.dedupe. The files and bytes saved are
+            reported in self.stats.
+
+            incremental skip the entries already at the destination with
+            the same size and mtime, verify (python engine) also compare
+            their content, rewriting only what differs. delete remove
+            from the folders of the archive what is not in the archive.
+            The files written, skipped and deleted are counted in
+            self.stats. Both run in a single process.
+
+            journal keep a journal in the destination, removed at the end
+            (single process only), see epack.journal. resume (implies
+            journal) continue a stopped or crashed extraction from it,
+            the resumed entries are counted in self.stats.
+
+            listing, if given, is a DirTree filled with the entries (or
+            the _QueuedListing of extract()).
+        """
+        if include or exclude:
+            matcher = PathMatcher(include, exclude)
+        else:
+            matcher = None
+        tree = self._tree
+        if tree is None and listing is None:
+            # not listed in this session (ex: headless), maybe before
+            tree = self._tree = self.cache.load(archive_file)
+        seek = None
+        if matcher is not None and listing is None and jobs == 1 and \
+           not delete and not resume and tree is not None and \
+           tree.seek_index is not None:
+            # a selection from a compressed archive with a seek index:
+            # only decode the parts around the selected entries
+            offsets = tree.offsets(matcher)
+            if offsets is not None:
+                seek = (tree.seek_index, offsets)
+        if seek is not None:
+            self.progress.reset(sum(size for offset, size in seek[1]),
+                                len(seek[1]))
+        elif listing is None and matcher is None and tree is not None:
+            self.progress.reset(tree.total_size, tree.count)
+        else:
+            # total unknown (or not matching the selection), the progress
+            # follow the compressed input
+            self.progress.reset(input_size=os.path.getsize(archive_file))
+        self.stats = {}
+        # the workers of a parallel extraction could not share what they
+        # have seen, nor count it
+        if jobs == 1 or dedupe or incremental or delete or resume:
+            extractor = Extractor(self.progress, self._stoprequest,
+                                  engine=engine, flags=flags,
+                                  same_owner=same_owner,
+                                  detect_holes=detect_holes, sync=sync,
+                                  pipeline=pipeline, dedupe=dedupe,
+                                  incremental=incremental, verify=verify,
+                                  delete=delete, journal=journal,
+                                  resume=resume)
+        else:
+            from epack.parallel import ParallelExtractor  # multiprocessing
+            extractor = ParallelExtractor(jobs, self.progress,
+                                          self._stoprequest,
+                                          engine=engine, flags=flags,
+                                          same_owner=same_owner,
+                                          detect_holes=detect_holes,
+                                          sync=sync, pipeline=pipeline)
+        try:
+            if seek is not None:
+                extractor.extract(archive_file, destination, matcher=matcher,
+                                  seek=seek)
+            else:
+                extractor.extract(archive_file, destination, listing, matcher)
+        except RuntimeError as e:
+            return 'stopped'
+        except Exception as e:
+            return str(e)
+        self.stats = extractor.stats
+        if isinstance(listing, DirTree):
+            listing.finalize()
+            self._tree = listing
+            # a gzip listing is better taken by list_content(), with its
+            # seek index
+            if not seekindex.is_gzip(archive_file):
+                listing.seek_index = seekindex.load_index(archive_file)
+                self.cache.store(archive_file, listing)
+        return 'success'
+
     def abort(self):
         self._stoprequest.set()
-        self._cleanup()
+        # wait for the thread of list_content()/extract(); a *_sync call
+        # in another thread will see the request and stop on its own
+        if self._thread:
+            self._cleanup()
 
     def _cleanup(self):
         if self._thread:
@@ -74,88 +260,170 @@ class LibarchiveBackend(object):
             self._thread = None
         self._stoprequest.clear()
         
-    def _list_in_a_thread(self, archive_file):
-        L = list()
-        self._total_size = 0
-        with self.libarchive.file_reader(archive_file) as archive:
-            for entry in archive:
-                L.append(entry.pathname)
-                self._total_size += entry.size
-                if self._stoprequest.isSet():
-                    break
-        self._queue.put(sorted(L))
-
-    def _extract_in_a_thread(self, archive_file, destination):
-        written = 0
-        perm_to_apply = []
-        try:
-            with self.libarchive.file_reader(archive_file) as archive:
-                for entry in archive:
-                    # print(entry.pathname, entry.size, oct(entry.perm), entry.mtime, entry.isdir)
-                    path = os.path.join(destination, entry.pathname)
-
-                    # create a folder
-                    if entry.isdir:
-                        if not os.path.exists(path):
-                            os.makedirs(path)
-                        perm_to_apply.insert(0, (path, entry.perm))
-
-                    # or write a file to disk
-                    else: # TODO test other special types
-                        # ensure the folder where the file reside exists
-                        dirname = os.path.dirname(path)
-                        if not os.path.exists(dirname):
-                            os.makedirs(dirname)
-                        # write the file
-                        with open(path, 'wb') as f:
-                            for block in entry.get_blocks():
-                                f.write(block)
-                                written += len(block)
-                                perc = float(written) / self._total_size
-                                self._queue.put((perc, entry.pathname))
-
-                                if self._stoprequest.isSet():
-                                    raise RuntimeError('stopped')
-                        # apply correct permission to files
-                        os.chmod(path, entry.perm)
-
-                    # apply correct mtime to files and folders
-                    os.utime(path, (-1, entry.mtime))
-
-            # apply correct permission to folders (should be well ordered)
-            for path, perm in perm_to_apply:
-                os.chmod(path, perm)
+    def _list_in_a_thread(self, archive_file, queue):
+        tree = self.cache.load(archive_file)
+        if tree is not None:
+            queue.put(('cached', tree))
+            return
 
-        except RuntimeError as e:
-            self._queue.put(('done', 'stopped'))
+        batch = []
+        last_put = 0.0  # the first entry is sent at once
+        index, complete = None, False
+        try:
+            with self._open_for_listing(archive_file) as (archive, index):
+                for n, entry in enumerate(archive):
+                    batch.append((entry.pathname, entry.size, entry.isdir,
+                                  entry.mtime, entry.filetype | entry.perm,
+                                  n, archive.header_position))
+                    now = time.time()
+                    if len(batch) >= LIST_BATCH_SIZE or \
+                       now - last_put >= LIST_BATCH_INTERVAL:
+                        queue.put(('batch', batch))
+                        batch, last_put = [], now
+                    if self._stoprequest.isSet():
+                        break
+                else:
+                    complete = True
         except Exception as e:
-            self._queue.put(('error', str(e)))
-        else:
-            self._queue.put(('done', 'success'))
+            print('Listing failed: %s' % e)
+        if batch:
+            queue.put(('batch', batch))
+        queue.put(('done', index if complete else False))
 
-    def _check_list_queue(self, done_cb):
-        if self._queue.empty():
-            return ecore.ECORE_CALLBACK_RENEW
+    @contextmanager
+    def _open_for_listing(self, archive_file):
+        """ Open the archive to list it, yielding (archive, seek_index).
 
-        self._cleanup()
-        done_cb(self._queue.get())
-        return ecore.ECORE_CALLBACK_CANCEL
+            A gzip file is decompressed by seekindex, so that its seek
+            index is built while listing; an xz file made of many blocks
+            has its own index. The others have no index at all.
+        """
+        if seekindex.is_gzip(archive_file):
+            index = seekindex.GzipIndex(
+                seekindex.GzipIndex.span_for(archive_file))
+            with seekindex.IndexedStream(archive_file, index) as stream:
+                with self.libarchive.stream_reader(stream) as archive:
+                    yield archive, index
+            return
+        index = seekindex.load_index(archive_file)
+        with self.libarchive.mmap_reader(archive_file) as archive:
+            yield archive, index
 
-    def _check_extract_queue(self, progress_cb, done_cb):
-        # is an item available in the queue ?
-        if self._queue.empty():
+    def _extract_in_a_thread(self, archive_file, destination, listing,
+                             options):
+        result = self.extract_sync(archive_file, destination,
+                                   listing=listing, **options)
+        if listing is not None:
+            # a gzip listing is better taken by list_content(), with its
+            # seek index: not complete, so not cached
+            if result != 'success' or seekindex.is_gzip(archive_file):
+                index = False
+            else:
+                index = seekindex.load_index(archive_file)
+            listing.done(index)
+        self._queue.put(('done', result))
+
+    def _drain_list_queue(self, archive_file, queue, tree, nodes=None):
+        """ Add the queued batches to tree, and the new topmost nodes to
+            nodes (if given). Return (tree, done): tree is another one if
+            it was found in the cache, at the end it is finalized, saved in
+            the cache and used by the next extractions.
+        """
+        done = complete = False
+        while not queue.empty():
+            event, data = queue.get()
+            if event == 'cached':
+                tree = data
+                done = True
+                break
+            if event == 'done':
+                # the seek index, False if the listing is not complete
+                complete = data is not False
+                if complete:
+                    tree.seek_index = data
+                done = True
+                break
+            for args in data:
+                node = tree.add(*args)
+                if node is not None and nodes is not None:
+                    nodes.append(node)
+
+        if done:
+            if not tree.complete:
+                tree.finalize()
+                if complete:
+                    self.cache.store(archive_file, tree)
+            self._tree = tree
+        return tree, done
+
+    def _check_list_queue(self, archive_file, queue, done_cb, batch_cb, tree):
+        from efl import ecore
+
+        # the tree is only touched here, in the main thread
+        nodes = []
+        tree, done = self._drain_list_queue(archive_file, queue, tree, nodes)
+        if nodes and batch_cb is not None:
+            batch_cb(tree, nodes)
+        if not done:
             return ecore.ECORE_CALLBACK_RENEW
 
-        # get the last item in the queue
-        while not self._queue.empty():
-            item1, item2 = self._queue.get()
+        # listing completed (the thread is over, maybe another one started)
+        done_cb(tree)
+        return ecore.ECORE_CALLBACK_CANCEL
+
+    def _check_extract_queue(self, archive_file, progress_cb, done_cb,
+                             list_cb, batch_cb, listing, tree):
+        from efl import ecore
 
-        # call the progress callback
-        if isinstance(item1, float):
-            progress_cb(item1, item2)
+        # the queue only receive the final result, progress is sampled
+        if self._queue.empty():
+            if listing is not None:
+                nodes = []
+                self._drain_list_queue(archive_file, listing.queue, tree,
+                                       nodes)
+                if nodes and batch_cb is not None:
+                    batch_cb(tree, nodes)
+            if self.progress.sample():
+                progress_cb(self.progress.fraction, self.progress.current)
             return ecore.ECORE_CALLBACK_RENEW
 
         # extract completed
+        item1, item2 = self._queue.get()
         self._cleanup()
+        if list_cb is not None:
+            # the last batches, the tree is finalized
+            nodes = []
+            self._drain_list_queue(archive_file, listing.queue, tree, nodes)
+            if nodes and batch_cb is not None:
+                batch_cb(tree, nodes)
+            list_cb(tree)
         done_cb(item2)
         return ecore.ECORE_CALLBACK_CANCEL
+
+
+class _QueuedListing(object):
+    """ Given as the listing of a single pass extraction in a thread: the
+        entries added are sent to queue in batches, as _list_in_a_thread()
+        does, for the main thread to build the DirTree
+    """
+    def __init__(self, queue):
+        self.queue = queue
+        self._batch = []
+        self._last_put = 0.0  # the first entry is sent at once
+
+    def add(self, *args):
+        self._batch.append(args)
+        now = time.time()
+        if len(self._batch) >= LIST_BATCH_SIZE or \
+           now - self._last_put >= LIST_BATCH_INTERVAL:
+            self.queue.put(('batch', self._batch))
+            self._batch, self._last_put = [], now
+
+    def done(self, index):
+        """ The extraction is over, index is the seek index of the archive
+            (None if it has none) or False if the listing is not complete
+        """
+        if self._batch:
+            self.queue.put(('batch', self._batch))
+            self._batch = []
+        self.queue.put(('done', index))
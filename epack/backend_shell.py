@@ -18,9 +18,15 @@
 from __future__ import absolute_import, print_function, unicode_literals
 
 import os
-import magic
+import subprocess
+try:
+    from shlex import quote # py3
+except ImportError:
+    from pipes import quote # py2
 
-from efl import ecore
+from epack.dirtree import DirTree
+from epack.probe import magic_mime_type
+from epack.progress import Progress
 
 
 # the extracting application needs support to read from stdin.
@@ -59,10 +65,12 @@ LIST_MAP = {
     'application/iso9660-image': 'bsdtar -tf -','application/x-iso9660-image': 'bsdtar -tf -'
 }
 
-def mime_type_query(fname):
-    m = magic.open(magic.MAGIC_MIME_TYPE)
-    m.load()
-    return m.file(fname)
+def mime_type_query(fname, info=None):
+    """ mime-type from the probe if it knows the file, from libmagic if not
+    """
+    if info is not None and info.known:
+        return info.mime
+    return magic_mime_type(fname)
 
 class ShellBackend(object):
     """ This backend use pv + bsdtar to extract archives
@@ -70,41 +78,110 @@ class ShellBackend(object):
     """
     name = "bsdtar"
 
-    def __init__(self, archive_file):
+    def __init__(self, archive_file, info=None):
 
         # TODO check if pv and bsdtar are installed
 
-        self.mime_type = mime_type_query(archive_file)
+        self.mime_type = mime_type_query(archive_file, info)
         if not self.mime_type in EXTRACT_MAP:
             raise RuntimeError('mime-type not supported')
 
-    def list_content(self, archive_file, done_cb):
-        self._contents = list()
+        # pv only knows about the compressed size
+        self.progress = Progress()
+        self._proc = None
+
+    def list_content(self, archive_file, done_cb, batch_cb=None):
+        from efl import ecore  # only the *_sync methods work without efl
+
+        self._tree = DirTree()
         cmd = '%s "%s"' % (LIST_MAP.get(self.mime_type), archive_file)
         exe = ecore.Exe(cmd, ecore.ECORE_EXE_PIPE_READ |
                              ecore.ECORE_EXE_PIPE_READ_LINE_BUFFERED)
-        exe.on_data_event_add(self._list_stdout)
+        exe.on_data_event_add(self._list_stdout, batch_cb)
         exe.on_del_event_add(self._list_done, done_cb)
 
-    def extract(self, archive_file, destination, progress_cb, done_cb):
+    def extract(self, archive_file, destination, progress_cb, done_cb,
+                list_cb=None, batch_cb=None, include=None, exclude=None,
+                **options):
+        from efl import ecore
+
+        # options not supported by bsdtar are ignored
+        if list_cb is not None:
+            # bsdtar cannot list while extracting, do it in two passes
+            def _listed(file_list):
+                list_cb(file_list)
+                self.extract(archive_file, destination, progress_cb, done_cb,
+                             include=include, exclude=exclude, **options)
+            self.list_content(archive_file, _listed, batch_cb)
+            return
+
+        self.progress.reset(os.path.getsize(archive_file))
         os.chdir(destination)
         cmd = 'pv -n "%s" | %s ' % (archive_file, EXTRACT_MAP.get(self.mime_type))
+        for pattern in exclude or ():
+            cmd += ' --exclude %s' % quote(pattern)
+        if include:
+            cmd += ' -- ' + ' '.join(quote(p.rstrip('/')) for p in include)
         exe = ecore.Exe(cmd, ecore.ECORE_EXE_PIPE_ERROR |
                              ecore.ECORE_EXE_PIPE_ERROR_LINE_BUFFERED)
         exe.on_error_event_add(self._extract_stderr, progress_cb)
         exe.on_del_event_add(self._extract_done, done_cb)
 
-    def abort(self):
-        raise NotImplementedError
+    def list_sync(self, archive_file):
+        """ List in the calling thread, return the complete DirTree """
+        self._tree = DirTree()
+        self._proc = subprocess.Popen(['bsdtar', '-tf', archive_file],
+                                      stdout=subprocess.PIPE)
+        for line in self._proc.stdout:
+            self._tree.add(line.decode('utf8', 'replace').rstrip('\n'))
+        self._proc.wait()
+        self._proc = None
+        self._tree.finalize()
+        return self._tree
+
+    def extract_sync(self, archive_file, destination, include=None,
+                     exclude=None, **options):
+        """ Extract in the calling thread (no pv, no progress), return
+            'success', 'stopped' or the error message
+        """
+        self.progress.reset(os.path.getsize(archive_file))
+        cmd = ['bsdtar', '-xf', archive_file, '-C', destination]
+        for pattern in exclude or ():
+            cmd += ['--exclude', pattern]
+        if include:
+            cmd += ['--'] + [p.rstrip('/') for p in include]
+        self._proc = subprocess.Popen(cmd, stderr=subprocess.PIPE)
+        err = self._proc.communicate()[1]
+        code, self._proc = self._proc.returncode, None
+        if code < 0:
+            return 'stopped'
+        if code != 0:
+            return err.decode('utf8', 'replace').strip() or \
+                   'bsdtar failed with code %d' % code
+        self.progress.bytes_done = self.progress.total_size
+        return 'success'
 
-    def _list_stdout(self, command, event):
-        self._contents.extend(event.lines)
+    def abort(self):
+        proc = self._proc
+        if proc is None:
+            raise NotImplementedError
+        proc.terminate()
+
+    def _list_stdout(self, command, event, batch_cb):
+        # bsdtar -t only gives the names
+        nodes = [node for node in map(self._tree.add, event.lines)
+                 if node is not None]
+        if nodes and batch_cb is not None:
+            batch_cb(self._tree, nodes)
 
     def _list_done(self, command, event, done_cb):
-        done_cb(sorted(self._contents))
+        self._tree.finalize()
+        done_cb(self._tree)
 
     def _extract_stderr(self, command, event, progress_cb):
-        progress = float(event.lines[0]) / 100
+        progress = float(event.lines[-1]) / 100
+        self.progress.bytes_done = int(progress * self.progress.total_size)
+        self.progress.sample()
         progress_cb(progress, '')
 
     def _extract_done(self, command, event, progress_cb):
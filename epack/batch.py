@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+# encoding: utf-8
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+import os
+import time
+import threading
+from collections import defaultdict
+
+from epack.backend import load_backend
+from epack.extractor import makedirs
+
+
+def device_of(path):
+    """ st_dev of the filesystem where path is (or will be) created """
+    path = os.path.abspath(path)
+    while not os.path.exists(path):
+        path = os.path.dirname(path)
+    return os.stat(path).st_dev
+
+
+class BatchJob(object):
+    """ One archive of the batch, result is None until it's done """
+    __slots__ = ('archive', 'destination', 'device', 'size', 'backend',
+                 'result', 'elapsed')
+
+    def __init__(self, archive, destination):
+        self.archive = archive
+        self.destination = destination
+        self.backend = None
+        self.result = None
+        self.elapsed = 0.0
+        try:
+            self.size = os.path.getsize(archive)
+            self.device = device_of(destination)
+        except OSError as e:
+            self.size, self.device = 0, None
+            self.result = str(e)
+
+    @property
+    def fraction(self):
+        if self.result is not None:
+            return 1.0
+        if self.backend is not None:
+            return self.backend.progress.fraction
+        return 0.0
+
+
+class BatchExtractor(object):
+    """ Extract many archives using a bounded pool of worker threads.
+
+        At most per_device archives are extracted at the same time in the
+        same destination filesystem, so that a slow disk is not thrashed
+        while another one stays idle. Every archive is extracted by the
+        backend choosen by load_backend(), in its own destination (the
+        archive folder if destination is None), with the given extract
+        options.
+    """
+    def __init__(self, archives, destination=None, workers=2, per_device=1,
+                 **options):
+        self.jobs = []
+        for archive in archives:
+            archive = os.path.abspath(archive)
+            dest = destination or os.path.dirname(archive)
+            self.jobs.append(BatchJob(archive, dest))
+        self.workers = max(1, workers)
+        self.per_device = max(1, per_device)
+        self.options = options
+        self._pending = [job for job in self.jobs if job.result is None]
+        self._busy = defaultdict(int)
+        self._cond = threading.Condition()
+        self._aborted = False
+
+    @property
+    def fraction(self):
+        """ Aggregate progress, weighted on the archives size """
+        total = sum(job.size for job in self.jobs)
+        if total == 0:
+            return 1.0
+        return sum(job.size * job.fraction for job in self.jobs) / total
+
+    @property
+    def done(self):
+        return [job for job in self.jobs if job.result is not None]
+
+    @property
+    def running(self):
+        return [job for job in self.jobs
+                if job.backend is not None and job.result is None]
+
+    @property
+    def failed(self):
+        return [job for job in self.jobs
+                if job.result is not None and job.result != 'success']
+
+    def run(self, report_cb=None, interval=1.0):
+        """ Extract all the archives, calling report_cb(self) every interval
+            seconds. Return the number of failed archives.
+        """
+        threads = []
+        for i in range(min(self.workers, len(self._pending))):
+            t = threading.Thread(target=self._worker)
+            t.daemon = True
+            t.start()
+            threads.append(t)
+
+        try:
+            for t in threads:
+                while t.is_alive():
+                    t.join(interval)
+                    if report_cb and t.is_alive():
+                        report_cb(self)
+        except KeyboardInterrupt:
+            self.abort()
+            for t in threads:
+                t.join()
+
+        return len(self.failed)
+
+    def abort(self):
+        with self._cond:
+            self._aborted = True
+            for job in self._pending:
+                job.result = 'stopped'
+            del self._pending[:]
+            self._cond.notify_all()
+        for job in self.running:
+            try:
+                job.backend.abort()
+            except NotImplementedError:
+                pass
+
+    def _next_job(self):
+        """ Pop the first pending job whose device has a free slot, wait
+            for one if needed. Return None when there is nothing left.
+        """
+        with self._cond:
+            while self._pending:
+                for i, job in enumerate(self._pending):
+                    if self._busy[job.device] < self.per_device:
+                        self._busy[job.device] += 1
+                        return self._pending.pop(i)
+                self._cond.wait()
+        return None
+
+    def _job_done(self, job):
+        with self._cond:
+            self._busy[job.device] -= 1
+            self._cond.notify_all()
+
+    def _worker(self):
+        while True:
+            job = self._next_job()
+            if job is None:
+                return
+            start = time.time()
+            try:
+                job.result = self._extract(job)
+            except Exception as e:
+                job.result = str(e)
+            job.elapsed = time.time() - start
+            self._job_done(job)
+
+    def _extract(self, job):
+        backend = load_backend(job.archive)
+        if backend is None:
+            return 'Cannot read archive'
+        job.backend = backend
+        if self._aborted:
+            return 'stopped'
+        makedirs(job.destination)
+        return backend.extract_sync(job.archive, job.destination,
+                                    **self.options)
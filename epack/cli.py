@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# encoding: utf-8
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+""" Headless mode: list or extract one archive without any UI and without
+    efl, using the *_sync methods of the backends.
+
+    The progress is written on stderr, one JSON object per line:
+      {"event": "start", "archive": ..., "destination": ..., "backend": ...}
+      {"event": "progress", "fraction": ..., "bytes": ..., "entries": ...,
+       "rate": ..., "eta": ..., "current": ...}
+      {"event": "done", "result": ..., "elapsed": ...}
+    the done event of an extraction also has the backend stats, if any
+    (ex: "bytes_saved" with dedupe, "written", "skipped" and "deleted"
+    with incremental, "resumed" with resume).
+"""
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+import os
+import sys
+import json
+import time
+import threading
+
+from epack.backend import load_backend
+
+
+# exit codes
+EXIT_SUCCESS = 0
+EXIT_FAILED = 1     # the extraction failed
+EXIT_USAGE = 2      # bad arguments or unreadable archive
+EXIT_STOPPED = 130  # interrupted (128 + SIGINT)
+
+# seconds between two progress lines
+PROGRESS_INTERVAL = 1.0
+
+
+def emit(event, stream=None, **data):
+    """ Write a machine-readable event line (on stderr by default) """
+    data['event'] = event
+    stream = stream or sys.stderr
+    stream.write(json.dumps(data, sort_keys=True) + '\n')
+    stream.flush()
+
+
+def _emit_progress(progress):
+    progress.sample()
+    eta = progress.eta
+    emit('progress', fraction=round(progress.fraction, 4),
+         bytes=progress.bytes_done, entries=progress.entries_done,
+         rate=int(progress.bytes_rate), current=progress.current,
+         eta=round(eta, 1) if eta is not None else None)
+
+
+def _run_in_thread(backend, func, *args, **kargs):
+    """ Call func in a worker thread, reporting the backend progress every
+        PROGRESS_INTERVAL seconds, return its result or 'stopped' on
+        ctrl-c
+    """
+    result = []
+    thread = threading.Thread(target=lambda: result.append(func(*args,
+                                                                **kargs)))
+    thread.daemon = True
+    thread.start()
+    try:
+        while thread.is_alive():
+            thread.join(PROGRESS_INTERVAL)
+            if thread.is_alive():
+                _emit_progress(backend.progress)
+    except KeyboardInterrupt:
+        try:
+            backend.abort()
+        except NotImplementedError:
+            pass
+        thread.join()
+        return 'stopped'
+    return result[0] if result else 'stopped'
+
+
+def run_headless(archive, destination=None, list_only=False, **options):
+    """ List (on stdout) or extract archive, return the exit code.
+        options are the backend extract_sync() options.
+    """
+    if not archive:
+        emit('done', result='no archive given', elapsed=0)
+        return EXIT_USAGE
+    archive = os.path.abspath(archive)
+    start = time.time()
+    backend = load_backend(archive) if os.path.isfile(archive) else None
+    if backend is None:
+        emit('done', result='Cannot read archive', elapsed=0)
+        return EXIT_USAGE
+
+    if list_only:
+        emit('start', archive=archive, destination=None,
+             backend=backend.name)
+        tree = backend.list_sync(archive)
+        for path in tree.paths():
+            print(path)
+        emit('done', result='success', entries=tree.count,
+             size=tree.total_size, elapsed=round(time.time() - start, 3))
+        return EXIT_SUCCESS
+
+    destination = os.path.abspath(destination or os.path.dirname(archive))
+    if not os.path.isdir(destination):
+        os.makedirs(destination)
+    emit('start', archive=archive, destination=destination,
+         backend=backend.name)
+    result = _run_in_thread(backend, backend.extract_sync, archive,
+                            destination, **options)
+    _emit_progress(backend.progress)
+    emit('done', result=result, elapsed=round(time.time() - start, 3),
+         **getattr(backend, 'stats', {}))
+    if result == 'success':
+        return EXIT_SUCCESS
+    return EXIT_STOPPED if result == 'stopped' else EXIT_FAILED
@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+# encoding: utf-8
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+import errno
+import hashlib
+
+from epack.writer import BUFFER_SIZE, REFLINK_UNSUPPORTED
+
+
+# the data of a file is held in memory up to this size, until it is known
+# whether it is a duplicate (then nothing is written at all); bigger files
+# are written while hashed, and replaced when they turn out to be duplicates
+HOLD_SIZE = BUFFER_SIZE
+
+_hash = getattr(hashlib, 'blake2b', hashlib.sha256)
+
+
+class DedupeOutput(object):
+    """ Same interface of DiskOutput, that it wraps: the files with the
+        same content of a file already extracted become a reflink of it
+        (a copy sharing the data blocks, where the filesystem supports
+        it), or else a hard link to it when they also have the same
+        permissions, mtime and owner. Otherwise they are written as usual.
+
+        The content is hashed while it streams through, files and bytes
+        saved are counted in files and bytes_saved.
+
+        Beware that hard links share their content: changing one of the
+        extracted files changes the others too.
+    """
+    def __init__(self, output, hold_size=HOLD_SIZE):
+        self.output = output
+        self.hold_size = hold_size
+        self.files = 0        # files deduplicated...
+        self.bytes_saved = 0  # ...and their size
+        self._contents = {}   # (size, digest): path of the first such file
+        self._links = {}      # (size, digest, perm, mtime, owner): same
+        self._keys = {}       # path: its keys in the two above
+        self._linked = {}     # path: target, of the hard links of the archive
+        self._reflink = True  # cleared at the first refused reflink
+        self._file = None     # (path, size, perm, mtime, owner) of the file
+        self._hash = None
+        self._end = 0         # where the last write ended
+        self._held = None     # [(offset, data)] not written yet...
+        self._held_size = 0
+        self._opened = False  # ...or the file is created
+
+    def entry(self, index):
+        self.output.entry(index)
+
+    def folder(self, *args):
+        self.output.folder(*args)
+
+    def symlink(self, *args):
+        self.output.symlink(*args)
+
+    def hardlink(self, path, target):
+        self.output.hardlink(path, target)
+        self._linked[path] = target
+
+    def metadata(self, *args):
+        self.output.metadata(*args)
+
+    def open(self, path, size, perm, mtime, owner, keep=0):
+        # a file extracted again has not the same content anymore
+        self._forget(path)
+        target = self._linked.pop(path, None)
+        if target is not None:
+            # the data of a hard link (cpio stores it with the last link),
+            # written through it: its other names get it too
+            self._forget(target)
+        if keep or target is not None:
+            # only partly rewritten, or shared: not deduplicated
+            self.output.open(path, size, perm, mtime, owner, keep)
+            self._hash = self._held = None
+            return
+        self._file = (path, size, perm, mtime, owner)
+        self._hash = _hash()
+        self._end = 0
+        self._held = []
+        self._held_size = 0
+        self._opened = False
+
+    def write(self, offset, data):
+        if self._hash is None:
+            self.output.write(offset, data)
+            return
+        if offset != self._end:  # a hole
+            self._hash.update(('\0%d\0' % offset).encode('ascii'))
+        self._hash.update(data)
+        self._end = offset + len(data)
+        if self._held is not None:
+            if self._held_size + len(data) <= self.hold_size:
+                self._held.append((offset, bytes(data)))  # data is reused
+                self._held_size += len(data)
+                return
+            self._flush()
+        self.output.write(offset, data)
+
+    def close(self, size):
+        if self._hash is None:
+            self.output.close(size)
+            return
+        path, prealloc, perm, mtime, owner = self._file
+        digest = self._hash.digest()
+        source = self._contents.get((size, digest)) if size else None
+        if source is None:
+            self._flush()
+            self.output.close(size)
+            if size:
+                keys = ((size, digest), (size, digest, perm, mtime, owner))
+                self._contents[keys[0]] = path
+                self._links[keys[1]] = path
+                self._keys[path] = keys
+            return
+
+        # a duplicate: a reflink if possible, before the file is closed
+        link = self._links.get((size, digest, perm, mtime, owner))
+        if self._held is not None:
+            if link is not None and not self._reflink:
+                self.output.hardlink(path, link)
+                self._saved(size)
+                return
+            self._create(0)  # empty, the data is to be cloned
+        if self._reflink and self._clone(source):
+            self.output.close(size)
+            self._saved(size)
+            return
+        # or a hard link, replacing the file
+        self._flush()
+        self.output.close(size)
+        if link is not None:
+            self.output.hardlink(path, link)
+            self._saved(size)
+
+    def finish(self):
+        self.output.finish()
+
+    def abort(self):
+        self._held = None
+        self.output.abort()
+
+    def _forget(self, path):
+        keys = self._keys.pop(path, None)
+        if keys is not None:
+            self._contents.pop(keys[0], None)
+            self._links.pop(keys[1], None)
+
+    def _create(self, size):
+        path, prealloc, perm, mtime, owner = self._file
+        self.output.open(path, size, perm, mtime, owner)
+        self._opened = True
+
+    def _flush(self):
+        """ Write the data held so far, the file is not a duplicate (or
+            too big to wait)
+        """
+        if self._held is None:
+            return
+        if not self._opened:
+            self._create(self._file[1])
+        for offset, data in self._held:
+            self.output.write(offset, data)
+        self._held = None
+
+    def _clone(self, source):
+        try:
+            self.output.reflink(source)
+        except OSError as e:
+            if e.errno == errno.EACCES:  # source not readable
+                return False
+            if e.errno not in REFLINK_UNSUPPORTED:
+                raise
+            self._reflink = False  # no need to try again
+            return False
+        return True
+
+    def _saved(self, size):
+        self.files += 1
+        self.bytes_saved += size
@@ -0,0 +1,560 @@
+#!/usr/bin/env python
+# encoding: utf-8
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+import sys
+from array import array
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None
+
+
+# when the index grow over this size (bytes) its rows are moved to a
+# temporary sqlite database on disk
+MEMORY_BUDGET = 128 * 1024 * 1024
+
+# how often (added entries) the memory size is checked
+_CHECK_EVERY = 0x10000
+
+# row flags
+_DIR = 1
+_IMPLICIT = 2
+
+# array typecode for 64 bit integers
+try:
+    array(str('q'))
+    _INT64 = str('q')
+except ValueError:  # py2, long is 64 bit on 64 bit unix
+    _INT64 = str('l')
+
+_ENCODE_ERRORS = 'surrogatepass' if sys.version_info[0] >= 3 else 'strict'
+
+if hasattr(array, 'tobytes'):
+    _array_tobytes, _array_frombytes = array.tobytes, array.frombytes
+else:  # py2
+    _array_tobytes, _array_frombytes = array.tostring, array.fromstring
+
+
+class DirNode(object):
+    """ A file or a folder in the archive.
+
+        Just a view over one row of the DirTree, created when needed: two
+        nodes of the same row compare equal. name and isdir are read at
+        creation time, the other attributes are read from the tree.
+        For folders size, file_count and folder_count are the totals of
+        everything inside (recursively), computed by DirTree.finalize().
+        implicit is True for the folders not present in the archive as an
+        entry of their own, only as the parent of other entries.
+    """
+    __slots__ = ('tree', 'id', 'name', 'isdir')
+
+    def __init__(self, tree, id, name, isdir):
+        self.tree = tree
+        self.id = id
+        self.name = name
+        self.isdir = isdir
+
+    def __eq__(self, other):
+        return isinstance(other, DirNode) and other.id == self.id and \
+               other.tree is self.tree
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return self.id
+
+    def __repr__(self):
+        return 'DirNode(%r)' % self.path
+
+    @property
+    def parent(self):
+        if self.id == 0:
+            return None
+        return self.tree.node(self.tree._store.get(self.id, 'parent'))
+
+    @property
+    def children(self):
+        """ list of the children nodes, None for files """
+        if not self.isdir:
+            return None
+        return [DirNode(self.tree, id, name, bool(flags & _DIR))
+                for id, name, flags in self.tree._store.children(self.id)]
+
+    @property
+    def size(self):
+        return self.tree._store.get(self.id, 'size')
+
+    @property
+    def mtime(self):
+        return self.tree._store.get(self.id, 'mtime')
+
+    @property
+    def mode(self):
+        return self.tree._store.get(self.id, 'mode')
+
+    @property
+    def pos(self):
+        """ position of the entry in the archive, -1 if implicit """
+        return self.tree._store.get(self.id, 'pos')
+
+    @property
+    def offset(self):
+        """ offset of the entry header in the uncompressed archive, -1 if
+            unknown
+        """
+        return self.tree._store.get(self.id, 'offset')
+
+    @property
+    def file_count(self):
+        return self.tree._store.get(self.id, 'files')
+
+    @property
+    def folder_count(self):
+        return self.tree._store.get(self.id, 'folders')
+
+    @property
+    def implicit(self):
+        return bool(self.tree._store.get(self.id, 'flags') & _IMPLICIT)
+
+    @property
+    def path(self):
+        """ Full path inside the archive, folders end with a slash """
+        return self.tree.path(self.id)
+
+    def sorted_children(self):
+        """ Folders first, then files, both sorted by name """
+        return sorted(self.children or (),
+                      key=lambda n: (not n.isdir, n.name))
+
+
+class DirTree(object):
+    """ Directory index of the archive content, so that the UI can expand
+        any folder looking only at its children.
+
+        Every entry (and every synthesized parent folder) is a row with an
+        id; path components are stored once, as a row only knows its
+        parent id and its own name. Rows live in typed arrays, without an
+        object per entry, and are moved to a temporary sqlite database
+        when they grow over memory_budget bytes.
+
+        Can be filled while the archive is read; the folders totals are
+        only valid when complete is True (after finalize()).
+        Only one thread at a time can use the tree.
+
+        seek_index, if set, is the seekindex of the (compressed) archive,
+        that together with the entries offsets allow to start decoding
+        near any entry.
+    """
+    def __init__(self, memory_budget=MEMORY_BUDGET):
+        self.memory_budget = memory_budget
+        self.count = 0  # number of entries added
+        self.complete = False
+        self.seek_index = None
+        self._store = _MemoryStore()
+        self._store.append(-1, '', _DIR, 0, 0, 0, -1, -1)
+        self.root = DirNode(self, 0, '', True)
+
+    @classmethod
+    def from_list(cls, file_list):
+        """ Build from a plain list of pathnames (folders end with a slash) """
+        tree = cls()
+        for path in file_list:
+            tree.add(path)
+        tree.finalize()
+        return tree
+
+    @property
+    def on_disk(self):
+        return not isinstance(self._store, _MemoryStore)
+
+    def add(self, pathname, size=0, isdir=None, mtime=0, mode=0, pos=-1,
+            offset=-1):
+        """ Add an archive entry, missing parent folders are synthesized.
+            If isdir is None a trailing slash tells folders. pos is the
+            position of the entry in the archive, offset the position of
+            its header in the uncompressed archive.
+
+            Return the topmost node created (the entry itself or one of
+            its synthesized parents), None if nothing new was created.
+            Files are never merged: a duplicated file entry (ex: appended
+            to a tar) get its own row.
+        """
+        if isdir is None:
+            isdir = pathname.endswith('/')
+        names = [n for n in pathname.split('/') if n and n != '.']
+        if not names:
+            return None
+        self.count += 1
+        self.complete = False
+        if self.count % _CHECK_EVERY == 0:
+            self._check_memory()
+
+        store = self._store
+        created = None
+        parent = 0
+        for name in names[:-1]:
+            id = store.find_folder(parent, name)
+            if id is None:
+                id = store.append(parent, name, _DIR | _IMPLICIT,
+                                  0, 0, 0, -1, -1)
+                if created is None:
+                    created = DirNode(self, id, name, True)
+            parent = id
+
+        name = names[-1]
+        id = store.find_folder(parent, name) if isdir else None
+        if id is not None:
+            store.update(id, flags=_DIR, mtime=mtime or 0, mode=mode or 0,
+                         pos=pos, offset=offset)
+        else:
+            id = store.append(parent, name, _DIR if isdir else 0,
+                              0 if isdir else (size or 0),
+                              mtime or 0, mode or 0, pos, offset)
+            if created is None:
+                created = DirNode(self, id, name, isdir)
+        return created
+
+    def finalize(self):
+        """ Compute the folders totals, call after all the add() """
+        self._store.finalize()
+        self.complete = True
+
+    def dump(self):
+        """ The rows of a complete tree as a dict of bytes, for load().
+            None for a tree kept on disk, too big to be saved cheaply.
+        """
+        if self.on_disk or not self.complete:
+            return None
+        store = self._store
+        data = dict((column, _array_tobytes(getattr(store, column)))
+                    for column in _MemoryStore.ARRAYS)
+        data['names'] = bytes(store._names)
+        data['count'] = self.count
+        return data
+
+    @classmethod
+    def load(cls, data, memory_budget=MEMORY_BUDGET):
+        """ Rebuild a complete tree from the dump() data """
+        tree = cls(memory_budget)
+        tree._store = _MemoryStore.from_dump(data)
+        tree.count = data['count']
+        tree.complete = True
+        return tree
+
+    def node(self, id):
+        return DirNode(self, id, self._store.name(id),
+                       bool(self._store.get(id, 'flags') & _DIR))
+
+    def path(self, id):
+        store = self._store
+        isdir = store.get(id, 'flags') & _DIR
+        names = []
+        while id > 0:
+            names.append(store.name(id))
+            id = store.get(id, 'parent')
+        path = '/'.join(reversed(names))
+        return path + '/' if isdir and path else path
+
+    @property
+    def total_size(self):
+        return self._store.get(0, 'size')
+
+    def paths(self):
+        """ All the pathnames, sorted (synthesized folders included) """
+        result = [path for id, path, flags in self._walk()]
+        result.sort()
+        return result
+
+    def offsets(self, matcher=None):
+        """ Sorted (offset, size) of the archive entries whose path is
+            accepted by matcher, None if some offset is unknown
+        """
+        store = self._store
+        result = []
+        for id, path, flags in self._walk():
+            if flags & _IMPLICIT or (matcher and not matcher(path)):
+                continue
+            offset = store.get(id, 'offset')
+            if offset < 0:
+                return None
+            result.append((offset, store.get(id, 'size')))
+        result.sort()
+        return result
+
+    def _walk(self):
+        """ (id, path, flags) of all the rows but the root, parents first """
+        stack = [(0, '')]
+        while stack:
+            id, prefix = stack.pop()
+            for child, name, flags in self._store.children(id):
+                if flags & _DIR:
+                    path = prefix + name + '/'
+                    stack.append((child, path))
+                else:
+                    path = prefix + name
+                yield child, path, flags
+
+    def _check_memory(self):
+        store = self._store
+        if sqlite3 is not None and isinstance(store, _MemoryStore) and \
+           store.nbytes > self.memory_budget:
+            self._store = _SqliteStore(store)
+
+
+class _MemoryStore(object):
+    """ Rows kept in arrays (one per column), names utf8 encoded one after
+        the other in a single buffer, children as linked lists
+    """
+    ARRAYS = ('parent', 'flags', 'size', 'mtime', 'mode', 'pos', 'offset',
+              'files', 'folders', '_name_end', '_first_child',
+              '_next_sibling')
+
+    def __init__(self):
+        self.parent = array(str('l'))
+        self.flags = array(str('B'))
+        self.size = array(_INT64)
+        self.mtime = array(_INT64)
+        self.mode = array(str('i'))
+        self.pos = array(str('l'))
+        self.offset = array(_INT64)
+        self.files = array(str('l'))
+        self.folders = array(str('l'))
+        self._names = bytearray()
+        self._name_end = array(str('l'))
+        self._first_child = array(str('l'))
+        self._next_sibling = array(str('l'))
+        self._folders = {}  # (parent id, name) -> folder id
+
+    def __len__(self):
+        return len(self.parent)
+
+    @classmethod
+    def from_dump(cls, data):
+        store = cls()
+        for column in cls.ARRAYS:
+            _array_frombytes(getattr(store, column), data[column])
+        store._names[:] = data['names']
+        # the folders lookup, only used by add()
+        names, name_end, parent = store._names, store._name_end, store.parent
+        start = 0
+        for id, flags in enumerate(store.flags):
+            if flags & _DIR:
+                name = names[start:name_end[id]]
+                store._folders[(parent[id],
+                                name.decode('utf-8', _ENCODE_ERRORS))] = id
+            start = name_end[id]
+        return store
+
+    @property
+    def nbytes(self):
+        arrays = [getattr(self, column) for column in self.ARRAYS]
+        return sum(a.itemsize * len(a) for a in arrays) + \
+               len(self._names) + len(self._folders) * 200
+
+    def append(self, parent, name, flags, size, mtime, mode, pos, offset):
+        id = len(self.parent)
+        self.parent.append(parent)
+        self.flags.append(flags)
+        self.size.append(size)
+        self.mtime.append(mtime)
+        self.mode.append(mode)
+        self.pos.append(pos)
+        self.offset.append(offset)
+        self.files.append(0)
+        self.folders.append(0)
+        self._names += name.encode('utf-8', _ENCODE_ERRORS)
+        self._name_end.append(len(self._names))
+        self._first_child.append(-1)
+        if parent >= 0:
+            self._next_sibling.append(self._first_child[parent])
+            self._first_child[parent] = id
+        else:
+            self._next_sibling.append(-1)
+        if flags & _DIR:
+            self._folders[(parent, name)] = id
+        return id
+
+    def find_folder(self, parent, name):
+        return self._folders.get((parent, name))
+
+    def get(self, id, column):
+        return getattr(self, column)[id]
+
+    def update(self, id, **values):
+        for column, value in values.items():
+            getattr(self, column)[id] = value
+
+    def name(self, id):
+        start = self._name_end[id - 1] if id > 0 else 0
+        return self._names[start:self._name_end[id]] \
+                   .decode('utf-8', _ENCODE_ERRORS)
+
+    def children(self, id):
+        names, name_end = self._names, self._name_end
+        flags, next_sibling = self.flags, self._next_sibling
+        result = []
+        child = self._first_child[id]
+        while child > 0:  # the root is nobody's child
+            name = names[name_end[child - 1]:name_end[child]]
+            result.append((child, name.decode('utf-8', _ENCODE_ERRORS),
+                           flags[child]))
+            child = next_sibling[child]
+        return result
+
+    def rows(self):
+        for id in range(len(self.parent)):
+            yield (id, self.parent[id], self.name(id), self.flags[id],
+                   self.size[id], self.mtime[id], self.mode[id], self.pos[id],
+                   self.offset[id])
+
+    def finalize(self):
+        parent, flags, size = self.parent, self.flags, self.size
+        files, folders = self.files, self.folders
+        for id in range(len(parent)):
+            if flags[id] & _DIR:
+                size[id] = files[id] = folders[id] = 0
+        # children always have an higher id than their parent
+        for id in range(len(parent) - 1, 0, -1):
+            p = parent[id]
+            size[p] += size[id]
+            if flags[id] & _DIR:
+                files[p] += files[id]
+                folders[p] += folders[id] + 1
+            else:
+                files[p] += 1
+
+
+class _SqliteStore(object):
+    """ Rows in a private temporary database (sqlite delete the file when
+        the connection is closed), same interface of _MemoryStore
+    """
+    COLUMNS = ('parent', 'flags', 'size', 'mtime', 'mode', 'pos', 'offset',
+               'files', 'folders')
+    FOLDER_CACHE = 0x10000  # folders lookups to remember
+
+    def __init__(self, source):
+        # the tree can be filled by a worker and then read by the UI
+        self._db = sqlite3.connect('', check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=OFF')
+        self._db.execute('PRAGMA synchronous=OFF')
+        self._db.execute('CREATE TABLE entries (id INTEGER PRIMARY KEY, '
+                         'parent INTEGER, name TEXT, flags INTEGER, '
+                         'size INTEGER, mtime INTEGER, mode INTEGER, '
+                         'pos INTEGER, offset INTEGER, '
+                         'files INTEGER DEFAULT 0, '
+                         'folders INTEGER DEFAULT 0)')
+        self._pending = list(source.rows())
+        self._count = len(self._pending)
+        self._flush()
+        self._db.execute('CREATE INDEX entries_parent ON entries '
+                         '(parent, name)')
+        self._folders = {}
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def nbytes(self):
+        return 0
+
+    def _flush(self):
+        if self._pending:
+            self._db.executemany('INSERT INTO entries (id, parent, name, '
+                                 'flags, size, mtime, mode, pos, offset) '
+                                 'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                 self._pending)
+            self._pending = []
+
+    def append(self, parent, name, flags, size, mtime, mode, pos, offset):
+        id = self._count
+        self._count += 1
+        self._pending.append((id, parent, name, flags, size, mtime, mode, pos,
+                              offset))
+        if flags & _DIR:
+            self._remember_folder(parent, name, id)
+        if len(self._pending) >= 1000:
+            self._flush()
+        return id
+
+    def _remember_folder(self, parent, name, id):
+        if len(self._folders) >= self.FOLDER_CACHE:
+            self._folders.clear()
+        self._folders[(parent, name)] = id
+
+    def find_folder(self, parent, name):
+        id = self._folders.get((parent, name))
+        if id is None:
+            self._flush()
+            row = self._db.execute('SELECT id FROM entries WHERE parent=? '
+                                   'AND name=? AND flags & %d' % _DIR,
+                                   (parent, name)).fetchone()
+            if row is not None:
+                id = row[0]
+                self._remember_folder(parent, name, id)
+        return id
+
+    def get(self, id, column):
+        assert column in self.COLUMNS
+        self._flush()
+        return self._db.execute('SELECT %s FROM entries WHERE id=?' % column,
+                                (id,)).fetchone()[0]
+
+    def update(self, id, **values):
+        assert all(column in self.COLUMNS for column in values)
+        self._flush()
+        columns = list(values)
+        self._db.execute('UPDATE entries SET %s WHERE id=?' %
+                         ', '.join('%s=?' % c for c in columns),
+                         [values[c] for c in columns] + [id])
+
+    def name(self, id):
+        self._flush()
+        return self._db.execute('SELECT name FROM entries WHERE id=?',
+                                (id,)).fetchone()[0]
+
+    def children(self, id):
+        self._flush()
+        return self._db.execute('SELECT id, name, flags FROM entries '
+                                'WHERE parent=?', (id,)).fetchall()
+
+    def rows(self):
+        self._flush()
+        return self._db.execute('SELECT id, parent, name, flags, size, mtime, '
+                                'mode, pos, offset FROM entries ORDER BY id')
+
+    def finalize(self):
+        self._flush()
+        # only the folders totals are kept in memory
+        totals = {}
+        updates = []
+        rows = self._db.execute('SELECT id, parent, flags, size FROM entries '
+                                'ORDER BY id DESC')
+        for id, parent, flags, size in rows:
+            if flags & _DIR:
+                size, files, folders = totals.pop(id, (0, 0, 0))
+                updates.append((size, files, folders, id))
+                files, folders = files, folders + 1
+            else:
+                files, folders = 1, 0
+            if id > 0:
+                t = totals.get(parent, (0, 0, 0))
+                totals[parent] = (t[0] + size, t[1] + files, t[2] + folders)
+        self._db.executemany('UPDATE entries SET size=?, files=?, folders=? '
+                             'WHERE id=?', updates)
@@ -0,0 +1,804 @@
+#!/usr/bin/env python
+# encoding: utf-8
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+import os
+import stat
+import errno
+import shutil
+import itertools
+import threading
+
+import epack.libarchive as libarchive
+from epack.libarchive import ffi
+from epack import seekindex
+from epack.progress import Progress
+from epack.writer import Writer, SYNC_NONE
+
+
+# extraction engines
+ENGINE_PYTHON = 'python'  # files are written by python code
+ENGINE_DISK = 'disk'      # files are written by libarchive (archive_write_disk)
+
+# entry types the python engine does not extract
+SPECIAL_TYPES = (ffi.AE_IFCHR, ffi.AE_IFBLK, ffi.AE_IFIFO, ffi.AE_IFSOCK)
+
+
+def makedirs(path):
+    """ os.makedirs that do not fail if someone else (another worker) create
+        the folder in the meantime
+    """
+    try:
+        os.makedirs(path)
+    except OSError:
+        if not os.path.isdir(path):
+            raise
+
+
+# os.utime() accept a file descriptor (futimens) since python 3.3, and
+# can set the time of a symlink itself (lutimes) where the os allows it
+_UTIME_FD = os.utime in getattr(os, 'supports_fd', ())
+_UTIME_NOFOLLOW = os.utime in getattr(os, 'supports_follow_symlinks', ())
+# os.link() of a symlink links the symlink itself, not its target
+_LINK_NOFOLLOW = os.link in getattr(os, 'supports_follow_symlinks', ())
+
+# os.link() errors where the filesystem cannot link the files: a copy of the
+# content is made instead
+_LINK_UNSUPPORTED = (errno.EXDEV, errno.EPERM, errno.EMLINK,
+                     getattr(errno, 'ENOTSUP', errno.EPERM))
+
+
+def apply_metadata(path, perm, mtime, owner=None, fd=None):
+    """ Restore the owner (a (uid, gid) tuple, if given), the permissions
+        and the mtime of path. With fd, the open file, no path lookup is
+        done at all (but for utime on old pythons).
+
+        The owner goes first, a chown can clear the setuid/setgid bits; not
+        being allowed to give the file away (not root) is not an error.
+    """
+    if owner is not None:
+        _chown(path, owner, fd)
+    if fd is not None:
+        os.fchmod(fd, perm)
+        os.utime(fd if _UTIME_FD else path, (mtime, mtime))
+    else:
+        os.chmod(path, perm)
+        os.utime(path, (mtime, mtime))
+
+
+def _chown(path, owner, fd=None):
+    try:
+        if fd is not None:
+            os.fchown(fd, *owner)
+        else:
+            os.lchown(path, *owner)
+    except OSError as e:
+        if e.errno != errno.EPERM:
+            raise
+
+
+def _remove(path):
+    """ Remove the file (or link) at path, if any, to make room for a link """
+    try:
+        os.unlink(path)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+
+
+def make_symlink(path, target, mtime, owner=None):
+    """ Create the symbolic link path pointing to target, with the owner
+        and the mtime of the link itself (the permissions of a symlink are
+        meaningless)
+    """
+    _remove(path)
+    os.symlink(target, path)
+    if owner is not None:
+        _chown(path, owner)
+    if _UTIME_NOFOLLOW:
+        os.utime(path, (mtime, mtime), follow_symlinks=False)
+
+
+def make_hardlink(path, target):
+    """ Create path as a hard link to target, an entry already extracted:
+        the data is not written again and it shares the metadata of target.
+        Where the filesystem has no hard links target is copied.
+    """
+    # tar stores a file added twice as a link to itself
+    if os.path.normpath(path) == os.path.normpath(target):
+        return
+    _remove(path)
+    try:
+        if _LINK_NOFOLLOW:
+            os.link(target, path, follow_symlinks=False)
+        else:
+            os.link(target, path)
+    except OSError as e:
+        if e.errno not in _LINK_UNSUPPORTED:
+            raise
+        if os.path.islink(target):
+            os.symlink(os.readlink(target), path)
+        else:
+            shutil.copy2(target, path)
+
+
+def apply_folders_metadata(folders):
+    """ Apply the (path, perm, mtime, owner) of the extracted folders, at
+        the end: deepest first, so that filling a folder does not change
+        its mtime again and a read-only folder is still writable while its
+        subfolders are done.
+    """
+    folders.sort(key=lambda f: f[0].rstrip('/').count('/'), reverse=True)
+    for path, perm, mtime, owner in folders:
+        apply_metadata(path, perm, mtime, owner)
+
+
+# granularity of the holes made from runs of zeros (detect_holes): the
+# pieces of this size, aligned in the file, that are all zeros are skipped.
+# Skipping zeros is always safe, the files are new and holes read as zeros
+HOLE_SIZE = 64 * 1024
+_ZEROS = b'\0' * HOLE_SIZE
+
+
+def data_extents(offset, block, hole_size=HOLE_SIZE):
+    """ Split the data block found at offset in the file into the
+        (offset, data) extents to write, leaving out the pieces made only of
+        zeros. The pieces are of hole_size, aligned in the file, but at the
+        edges of the block.
+    """
+    end = offset + len(block)
+    pos = offset
+    start = None  # where the current extent begun
+    zero = _ZEROS[:1]
+    while pos < end:
+        stop = min(end, (pos // hole_size + 1) * hole_size)
+        piece = block[pos - offset:stop - offset]
+        # cheap checks first, data rarely starts and ends with zeros (the
+        # views can be of chars, not comparable to bytes: use tobytes())
+        if piece[:1].tobytes() == zero and piece[-1:].tobytes() == zero and \
+           piece.tobytes() == _ZEROS[:stop - pos]:
+            if start is not None:
+                yield start, block[start - offset:pos - offset]
+                start = None
+        elif start is None:
+            start = pos
+        pos = stop
+    if start is not None:
+        yield start, block[start - offset:]
+
+
+def normpath(pathname):
+    """ The entry pathname as found on disk, relative to the destination:
+        no leading, trailing or doubled slashes, no '.' components
+    """
+    return '/'.join(n for n in pathname.split('/') if n and n != '.')
+
+
+def is_unsafe(pathname, link=False):
+    """ True if the entry pathname (or hard link target, with link) would
+        lead outside the destination: it has a '..' component, or is
+        absolute for a link target (absolute pathnames are made relative,
+        as tar does)
+    """
+    return '..' in pathname.split('/') or (link and pathname.startswith('/'))
+
+
+def entry_path(destination, pathname, link=False):
+    """ Where the entry pathname (or hard link target, with link) is
+        extracted inside destination, None if it is_unsafe()
+    """
+    if is_unsafe(pathname, link):
+        return None
+    return os.path.join(destination, normpath(pathname))
+
+
+def is_unchanged(entry, destination, st):
+    """ True if the entry was already extracted at destination, st being
+        the lstat() of its path: same size and mtime for the files (as
+        rsync does), same target for the links
+    """
+    if entry.issym:
+        path = entry_path(destination, entry.pathname)
+        return path is not None and stat.S_ISLNK(st.st_mode) and \
+               os.readlink(path) == entry.symlink
+    hardlink = entry.hardlink
+    if hardlink is not None and not entry.size:
+        target = entry_path(destination, hardlink, link=True)
+        if target is None:
+            return False
+        try:
+            target = os.lstat(target)
+        except OSError:
+            return False
+        return os.path.samestat(st, target)
+    return stat.S_ISREG(st.st_mode) and st.st_size == (entry.size or 0) and \
+           int(st.st_mtime) == entry.mtime
+
+
+def remove_extra(destination, names):
+    """ Remove from the folders of the archive at destination what is not
+        in the archive: names are all its normpath()s, with their parents.
+        What is beside the archive folders in destination is left alone,
+        and nothing outside destination is ever removed (names leading out
+        of it are ignored, and so are the folders that resolve out of it).
+        Return the number of files (and links) removed.
+    """
+    names = set(name for name in names
+                if not name.startswith('/') and not is_unsafe(name))
+    root = os.path.realpath(destination)
+
+    def inside(path):
+        return os.path.realpath(path).startswith(root + os.sep)
+
+    removed = 0
+    for top in set(name.split('/')[0] for name in names):
+        top_path = os.path.join(destination, top)
+        if os.path.islink(top_path) or not os.path.isdir(top_path):
+            continue
+        for dirpath, dirnames, filenames in os.walk(top_path):
+            if not inside(dirpath):
+                dirnames[:] = []
+                continue
+            folder = os.path.relpath(dirpath, destination).replace(os.sep, '/')
+            for name in list(dirnames):
+                path = os.path.join(dirpath, name)
+                if folder + '/' + name in names:
+                    continue
+                dirnames.remove(name)
+                if os.path.islink(path):  # not walked, a plain file
+                    filenames.append(name)
+                    continue
+                for d, dirs, files in os.walk(path):
+                    removed += len(files)
+                shutil.rmtree(path)
+            for name in filenames:
+                if folder + '/' + name not in names:
+                    os.unlink(os.path.join(dirpath, name))
+                    removed += 1
+    return removed
+
+
+def seek_runs(offsets, span):
+    """ Group the sorted (offset, size) of the entries to extract in
+        (start, end) runs: a new run starts when the next entry is so far
+        that restarting from a seek point is cheaper than decoding up to it.
+        end is the offset of the last entry in the run.
+    """
+    runs = []
+    for offset, size in offsets:
+        if runs and offset - runs[-1][2] <= span:
+            runs[-1][1] = offset
+            runs[-1][2] = max(runs[-1][2], offset + size)
+        else:
+            runs.append([offset, offset, offset + size])
+    return [(start, end) for start, end, stop in runs]
+
+
+class DiskOutput(object):
+    """ Where the python engine put the extracted entries: the folders are
+        created at once and their metadata applied at the end, the files
+        are written by a Writer and their metadata applied through the open
+        file, the links are made at once. A file is open(), write() n times
+        and close()d, finish() is called at the end, abort() on errors.
+
+        Nothing is written through a symlink: the folders inside the
+        destination must be real folders (an archive could make one a
+        symlink, then write its "content" anywhere), and an existing file
+        is replaced, not rewritten (it may be a link).
+
+        A hard link that cannot be made (ex: its target was not selected)
+        is added to failed, the others are still extracted; if the link
+        carries the data it is written as a plain file instead.
+    """
+    def __init__(self, writer, destination, failed=None):
+        self.writer = writer
+        self.destination = os.path.normpath(destination)
+        self.failed = failed if failed is not None else []
+        self._folders = []     # (path, perm, mtime, owner), for finish()
+        self._created = set()  # real folders known to exist, no need to stat
+        self._file = None      # (path, perm, mtime, owner, fd) of the open file
+        self._linked = None    # path of the last hard link made...
+        self._unlinked = None  # ...or (path, failure) of the one refused
+
+    def folder(self, path, perm, mtime, owner):
+        self._makedirs(path)
+        self._folders.append((path, perm, mtime, owner))
+
+    def symlink(self, path, target, mtime, owner):
+        self._makedirs(os.path.dirname(path))
+        make_symlink(path, target, mtime, owner)
+
+    def hardlink(self, path, target):
+        self._linked = self._unlinked = None
+        self._makedirs(os.path.dirname(path))
+        try:
+            self._makedirs(os.path.dirname(target), create=False)
+            make_hardlink(path, target)
+        except EnvironmentError:
+            failure = '%s: hard link to %s' % (self._relpath(path),
+                                               self._relpath(target))
+            self.failed.append(failure)
+            self._unlinked = (path, failure)
+            return
+        self._linked = path
+
+    def metadata(self, path, perm, mtime, owner):
+        """ Apply the metadata of a file already there, not written """
+        self._makedirs(os.path.dirname(path))
+        apply_metadata(path, perm, mtime, owner)
+
+    def open(self, path, size, perm, mtime, owner, keep=0):
+        """ Create the file, preallocated if size is given, or rewrite
+            the existing one after its first keep bytes. A hard link just
+            made at path is written through: it is the data of the link
+            (cpio stores it with the last link).
+        """
+        self._makedirs(os.path.dirname(path))
+        if not keep and path != self._linked:
+            _remove(path)
+        if self._unlinked is not None and self._unlinked[0] == path:
+            self.failed.remove(self._unlinked[1])  # the data is extracted
+        self._linked = self._unlinked = None
+        fd = self.writer.create(path, size, keep)
+        self._file = (path, perm, mtime, owner, fd)
+
+    def write(self, offset, data):
+        self.writer.write(offset, data)
+
+    def reflink(self, source):
+        """ Make the open file a copy of source sharing its data, see
+            Writer.reflink()
+        """
+        self.writer.reflink(source)
+
+    def flushed(self):
+        """ How much of the open file is written, see Writer.flushed """
+        return self.writer.flushed
+
+    def close(self, size):
+        path, perm, mtime, owner, fd = self._file
+        self._file = None
+        try:
+            self.writer.finish(size)
+            # metadata through the open file, once all the data is written
+            # (or it would change the mtime again)
+            apply_metadata(path, perm, mtime, owner, fd)
+        finally:
+            self.writer.close()
+
+    def finish(self):
+        apply_folders_metadata(self._folders)
+
+    def abort(self):
+        self._file = None
+        self.writer.close()
+
+    def _relpath(self, path):
+        return os.path.relpath(path, self.destination).replace(os.sep, '/')
+
+    def _makedirs(self, path, create=True):
+        """ Check that path is a real folder, creating it (and its parents)
+            if missing unless create is False
+        """
+        if path in self._created:
+            return
+        if os.path.normpath(path) == self.destination:
+            makedirs(path)  # may be (in) a symlink, given by the user
+            self._created.add(path)
+            return
+        parent = os.path.dirname(path)
+        if parent == path:
+            raise ValueError('%s is not inside %s' % (path, self.destination))
+        self._makedirs(parent, create)
+        try:
+            st = os.lstat(path)
+        except OSError as e:
+            if e.errno != errno.ENOENT or not create:
+                raise
+            try:
+                os.mkdir(path)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+                st = os.lstat(path)  # made meanwhile, by another worker
+            else:
+                st = None
+        if st is not None and not stat.S_ISDIR(st.st_mode):
+            raise OSError(errno.ENOTDIR, 'Cannot extract through a symlink'
+                          if stat.S_ISLNK(st.st_mode) else 'Not a directory',
+                          path)
+        self._created.add(path)
+
+
+class Extractor(object):
+    """ Extract an archive using libarchive, without any UI involved.
+
+        Meant to be run in a worker: the caller follow the progress counters
+        and can stop the extraction setting the stoprequest event, in that
+        case extract() raise RuntimeError('stopped').
+    """
+    def __init__(self, progress=None, stoprequest=None,
+                 engine=ENGINE_PYTHON, flags=None, same_owner=False,
+                 detect_holes=False, sync=SYNC_NONE, preallocate=True,
+                 pipeline=False, dedupe=False, incremental=False,
+                 verify=False, delete=False, journal=False, resume=False):
+        self.progress = progress or Progress()
+        self.stoprequest = stoprequest or threading.Event()
+        self.engine = engine
+        if flags is None:
+            flags = libarchive.extract.DEFAULT_FLAGS
+        self.flags = flags
+        # restore the owner of the entries (python engine, the disk engine
+        # has its 'owner' flag)
+        self.same_owner = same_owner
+        # make holes of the runs of zeros in the files, not only where the
+        # (sparse) entries have them
+        self.detect_holes = detect_holes
+        if detect_holes:
+            self.flags |= libarchive.extract.EXTRACT_SPARSE
+        # how the files are written, and made durable, see Writer
+        self.writer = Writer(sync, preallocate)
+        # write the files in another thread, while decoding the next data
+        # (python engine, see epack.pipeline)
+        self.pipeline = pipeline
+        # files identical to one already extracted become reflinks or hard
+        # links of it (python engine, see epack.dedupe)
+        self.dedupe = dedupe
+        # skip the entries already at the destination, with the same size
+        # and mtime; with verify compare their content too (python engine)
+        self.incremental = incremental
+        self.verify = verify and engine == ENGINE_PYTHON
+        # remove what is in the archive folders but not in the archive
+        self.delete = delete
+        # keep a journal in the destination, to resume the extraction
+        # after a stop or a crash, see epack.journal
+        self.journal = journal or resume
+        self.resume = resume
+        # what was done, beyond the progress counters (ex: bytes_saved)
+        self.stats = {}
+        self.failed = []      # why the entries not extracted were refused
+        self.total_size = 0  # size of the listed entries
+        self._archive = None  # the archive being read
+        self._destination = None
+        self._names = None    # normpath() of all the entries, for delete
+        self._journal = None  # the Journal of the extraction in progress
+        self._index = None    # index of the entry being extracted
+        # the next entry is to be compared with the file at the destination
+        # (verify, resume): None or the offset where the comparison starts
+        self._compare = None
+
+    def extract(self, archive_file, destination, listing=None, matcher=None,
+                indices=None, skip_dirs=False, seek=None):
+        """ Extract archive_file inside destination.
+
+            listing: a DirTree where all the entries are added
+            matcher: a callable(pathname), entries it refuse are skipped
+            indices: only extract the entries at this positions
+            skip_dirs: do not extract folders, the caller take care of them
+            seek: (seek_index, offsets) from a previous listing, see
+                  DirTree.offsets(); only the parts of the archive around
+                  the offsets are decoded (listing and indices are ignored,
+                  and so are delete and the journal: the entries are not
+                  all seen, nor numbered)
+        """
+        self._destination = destination
+        if self.incremental or self.delete:
+            self.stats.update(written=0, skipped=0, deleted=0)
+        if seek is not None:
+            entries = self._iter_runs(archive_file, matcher, skip_dirs, *seek)
+            self._extract(entries, destination)
+            return
+        self._names = set() if self.delete else None
+        journal = None
+        if self.journal:
+            from epack.journal import Journal
+            journal = self._journal = Journal(destination, archive_file)
+            if self.resume:
+                journal.load()
+                self.stats['resumed'] = 0
+            journal.open()
+        try:
+            with libarchive.mmap_reader(archive_file) as archive:
+                self._archive = archive
+                self._extract(self._iter_entries(archive, listing, matcher,
+                                                 indices, skip_dirs),
+                              destination)
+        except:
+            if journal is not None:
+                journal.close()  # kept, to resume
+            raise
+        finally:
+            self._journal = None
+        if journal is not None:
+            journal.close(remove=True)
+        if self.delete:
+            self.stats['deleted'] = remove_extra(destination, self._names)
+
+    def _extract(self, entries, destination):
+        if self.engine == ENGINE_DISK:
+            self._extract_with_libarchive(entries, destination)
+        else:
+            self._extract_with_python(entries, destination)
+        self.writer.sync_all(destination)
+        if self.failed:
+            raise Exception('%d entries not extracted, %s' %
+                            (len(self.failed), self.failed[0]))
+
+    def _iter_runs(self, archive_file, matcher, skip_dirs, index, offsets):
+        """ iterate the entries to extract, decoding only the runs of the
+            archive that contain them, each one starting from the nearest
+            seek point
+        """
+        for start, end in seek_runs(offsets, index.span):
+            with seekindex.IndexedStream(archive_file, index) as stream:
+                stream.seek(start)
+                with libarchive.stream_reader(stream) as archive:
+                    self._archive = archive
+                    for entry in self._iter_entries(archive, None, matcher,
+                                                    None, skip_dirs,
+                                                    end - start):
+                        yield entry
+
+    def _iter_entries(self, archive, listing, matcher, indices, skip_dirs,
+                      limit=None):
+        """ iterate the archive entries to extract, doing the per-entry
+            bookkeeping: progress, listing and skipping of the entries not
+            selected. With a limit stop at the first entry starting after
+            it.
+        """
+        progress = self.progress
+        names = self._names
+        journal = self._journal
+        for index, entry in enumerate(archive):
+            if limit is not None and archive.header_position > limit:
+                return
+            pathname = entry.pathname
+            progress.input_done = archive.bytes_read
+            if listing is not None:
+                listing.add(pathname, entry.size, entry.isdir, entry.mtime,
+                            entry.filetype | entry.perm, index,
+                            archive.header_position)
+                self.total_size += entry.size or 0
+            if names is not None and not is_unsafe(pathname):
+                name = normpath(pathname)
+                while name and name not in names:
+                    names.add(name)
+                    name = name.rpartition('/')[0]
+            if (matcher is not None and not matcher(pathname)) or \
+               (indices is not None and index not in indices) or \
+               (skip_dirs and entry.isdir):
+                entry.skip_data()
+                if self.stoprequest.is_set():
+                    raise RuntimeError('stopped')
+                continue
+            self._compare = None
+            if journal is not None and not entry.isdir and \
+               index in journal.done:
+                # extracted by the run that left the journal
+                entry.skip_data()
+                self.stats['resumed'] += 1
+                progress.bytes_done += entry.size or 0
+                progress.entries_done += 1
+                if self.stoprequest.is_set():
+                    raise RuntimeError('stopped')
+                continue
+            if self.incremental and not entry.isdir and \
+               self._check_unchanged(entry):
+                entry.skip_data()
+                self.stats['skipped'] += 1
+                progress.bytes_done += entry.size or 0
+                progress.entries_done += 1
+                if self.stoprequest.is_set():
+                    raise RuntimeError('stopped')
+                continue
+            if journal is not None and index in journal.partial and \
+               self.engine == ENGINE_PYTHON:
+                self._check_partial(entry, journal.partial[index])
+            self._index = index
+            progress.current = pathname
+            yield entry
+            progress.entries_done += 1
+
+    def _check_unchanged(self, entry):
+        """ True if the entry is to be skipped, already extracted. With
+            verify the files that look the same are compared: they are
+            not skipped here, _compare is set instead.
+        """
+        path = entry_path(self._destination, entry.pathname)
+        if path is None:
+            return False  # refused when written
+        try:
+            st = os.lstat(path)
+        except OSError:
+            return False
+        if not is_unchanged(entry, self._destination, st):
+            return False
+        # a file with many links would be rewritten through all of them
+        if self.verify and stat.S_ISREG(st.st_mode) and entry.size and \
+           st.st_nlink == 1:
+            self._compare = 0
+            return False
+        return True
+
+    def _check_partial(self, entry, offset):
+        """ The entry was being written up to offset by the run that left
+            the journal: continue it, comparing the last piece written
+            before offset (see VERIFY_SIZE) to be sure it is there
+        """
+        from epack.journal import VERIFY_SIZE
+        path = entry_path(self._destination, entry.pathname)
+        if path is None:
+            return
+        try:
+            st = os.lstat(path)
+        except OSError:
+            return
+        if stat.S_ISREG(st.st_mode) and st.st_size >= offset and \
+           st.st_nlink == 1 and entry.hardlink is None:
+            self._compare = max(0, offset - VERIFY_SIZE)
+
+    def _extract_with_python(self, entries, destination):
+        output = dedupe = DiskOutput(self.writer, destination, self.failed)
+        if self._journal is not None:
+            from epack.journal import JournalOutput
+            output = JournalOutput(output, self._journal)
+        if self.dedupe:
+            from epack.dedupe import DedupeOutput
+            output = dedupe = DedupeOutput(output)
+        if self.pipeline:  # the hashing happens in the writing thread too
+            from epack.pipeline import PipelinedOutput
+            output = PipelinedOutput(output)
+        try:
+            self._write_entries(entries, destination, output)
+            output.finish()
+        except:
+            output.abort()
+            raise
+        if self.dedupe:
+            self.stats['deduped_files'] = dedupe.files
+            self.stats['bytes_saved'] = dedupe.bytes_saved
+
+    def _write_entries(self, entries, destination, output):
+        progress = self.progress
+        stoprequest = self.stoprequest
+        same_owner = self.same_owner
+        detect_holes = self.detect_holes
+        stats = self.stats
+        counting = 'written' in stats
+        journal = self._journal
+        for entry in entries:
+            path = entry_path(destination, entry.pathname)
+            if path is None:
+                self.failed.append('%s: path with ..' % entry.pathname)
+                continue
+            owner = (entry.uid, entry.gid) if same_owner else None
+
+            # create a folder
+            if entry.isdir:
+                output.folder(path, entry.perm, entry.mtime, owner)
+                continue
+            if journal is not None:
+                output.entry(self._index)
+
+            # links are made, not written: a hard link to an entry already
+            # extracted shares its data (but some formats, like cpio, store
+            # the data with the last link: it is written after the link)
+            if entry.issym:
+                output.symlink(path, entry.symlink, entry.mtime, owner)
+                if counting:
+                    stats['written'] += 1
+                continue
+            size = entry.size or 0
+            hardlink = entry.hardlink
+            if hardlink is not None:
+                target = entry_path(destination, hardlink, link=True)
+                if target is None:
+                    self.failed.append('%s: hard link to %s' %
+                                       (entry.pathname, hardlink))
+                    continue
+                output.hardlink(path, target)
+                if not size:
+                    if counting:
+                        stats['written'] += 1
+                    continue
+
+            # devices, fifos and sockets are not extracted
+            elif entry.filetype & ffi.AE_IFMT in SPECIAL_TYPES:
+                continue
+
+            # an unchanged file, by size and mtime (or the one a resumed
+            # extraction was writing): compare the data, only what follows
+            # the first difference is written
+            blocks = entry.get_data_blocks()
+            keep = 0
+            compare, self._compare = self._compare, None
+            if compare is not None:
+                first = self._compare_data(path, blocks, compare)
+                if first is None:
+                    output.metadata(path, entry.perm, entry.mtime, owner)
+                    if counting:
+                        stats['skipped'] += 1
+                    continue
+                keep = first[0]
+                blocks = itertools.chain([first], blocks)
+            if counting:
+                stats['written'] += 1
+
+            # or write a file to disk, preallocated unless it will have holes
+            output.open(path, 0 if detect_holes or entry.issparse or keep
+                        else size, entry.perm, entry.mtime, owner, keep)
+            # the holes of sparse entries (and the runs of zeros with
+            # detect_holes) are skipped: not written nor allocated
+            end = 0
+            for offset, block in blocks:
+                if detect_holes:
+                    for start, data in data_extents(offset, block):
+                        output.write(start, data)
+                else:
+                    output.write(offset, block)
+                end = offset + len(block)
+                progress.bytes_done += len(block)
+                progress.input_done = self._archive.bytes_read
+
+                if stoprequest.is_set():
+                    raise RuntimeError('stopped')
+            # a trailing hole still counts in the file size
+            output.close(max(size, end))
+
+    def _compare_data(self, path, blocks, start=0):
+        """ Read the data blocks comparing them with the file at path
+            (from start, the data before it is trusted), return the first
+            (offset, block) that differs, None if they are all the same
+        """
+        progress = self.progress
+        with open(path, 'rb') as f:
+            for offset, block in blocks:
+                if offset + len(block) > start:
+                    f.seek(offset)
+                    if f.read(len(block)) != block.tobytes():
+                        return offset, block
+                progress.bytes_done += len(block)
+                progress.input_done = self._archive.bytes_read
+
+                if self.stoprequest.is_set():
+                    raise RuntimeError('stopped')
+        return None
+
+    def _extract_with_libarchive(self, entries, destination):
+        progress = self.progress
+        stoprequest = self.stoprequest
+        stats = self.stats
+        counting = 'written' in stats
+        journal = self._journal
+        with libarchive.disk_writer(destination, self.flags) as disk:
+            failed = disk.failed
+            for entry in entries:
+                if counting and not entry.isdir:
+                    stats['written'] += 1
+                refused = len(failed)
+                for size in disk.write_entry(entry):
+                    progress.bytes_done += size
+                    progress.input_done = self._archive.bytes_read
+
+                    if stoprequest.is_set():
+                        raise RuntimeError('stopped')
+                # written synchronously, done once write_entry() is over
+                if journal is not None and not entry.isdir and \
+                   len(failed) == refused:
+                    journal.entry_done(self._index)
+            self.failed.extend(failed)
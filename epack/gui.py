@@ -18,6 +18,8 @@
 from __future__ import absolute_import, print_function, unicode_literals
 
 import os
+import time
+from bisect import bisect
 
 from efl import ecore
 from efl import evas
@@ -54,10 +56,82 @@ class SafeIcon(Icon):
             print("ERROR: Cannot find icon: '%s'" % icon_name)
 
 
+# max time (seconds) spent appending genlist items in every main loop
+# iteration, about half of a frame at 60fps
+FILL_TIME_BUDGET = 0.008
+
+
+def _sort_key(node):
+    """ tree order: folders first, then by name """
+    return (not node.isdir, node.name)
+
+
+def _gl_compare(item1, item2):
+    """ genlist sort function, same order of _sort_key """
+    key1, key2 = _sort_key(item1.data), _sort_key(item2.data)
+    return (key1 > key2) - (key1 < key2)
+
+
+class TreeFiller(object):
+    """ Append the children of a folder to the genlist, sorted, in chunks
+        from an idler, so that opening a folder with a lot of files do not
+        freeze the UI. The first chunk is appended at once.
+    """
+    __slots__ = ('win', 'parent', 'nodes', 'keys', 'pos', 'idler')
+
+    def __init__(self, win, parent, nodes):
+        self.win = win
+        self.parent = parent  # the folder GenlistItem, None for the root
+        self.nodes = sorted(nodes, key=_sort_key)
+        self.keys = [_sort_key(node) for node in self.nodes]
+        self.pos = 0
+        self.idler = None
+        if self._fill() == ecore.ECORE_CALLBACK_RENEW:
+            self.idler = ecore.Idler(self._fill)
+
+    @property
+    def done(self):
+        return self.pos >= len(self.nodes)
+
+    def add(self, node):
+        """ Queue a node added to the folder after the filling started,
+            return False if its place has already been passed
+        """
+        if self.done:
+            return False
+        key = _sort_key(node)
+        i = bisect(self.keys, key)
+        if i < self.pos:
+            return False
+        self.keys.insert(i, key)
+        self.nodes.insert(i, node)
+        return True
+
+    def cancel(self):
+        if self.idler is not None:
+            self.idler.delete()
+            self.idler = None
+        self.pos = len(self.nodes)
+
+    def _fill(self):
+        deadline = time.time() + FILL_TIME_BUDGET
+        nodes, append = self.nodes, self.win.tree_item_append
+        while self.pos < len(nodes):
+            append(nodes[self.pos], self.parent)
+            self.pos += 1
+            if time.time() > deadline:
+                return ecore.ECORE_CALLBACK_RENEW
+        self.idler = None
+        return ecore.ECORE_CALLBACK_CANCEL
+
+
 class MainWin(StandardWindow):
     def __init__(self, app):
         self.app = app
         self.prog_popup = None
+        self._tree = None
+        self._expanded = {}  # DirNode -> GenlistItem of the open folders
+        self._fillers = {}   # DirNode -> TreeFiller of the folders in filling
 
         # the window
         StandardWindow.__init__(self, 'epack', 'Epack')
@@ -88,7 +162,9 @@ class MainWin(StandardWindow):
         self.fold_itc = GenlistItemClass(item_style="one_icon",
                                          text_get_func=self._gl_fold_text_get,
                                          content_get_func=self._gl_fold_icon_get)
-        self.file_list = Genlist(frame, homogeneous=True)
+        self.file_list = Genlist(frame, homogeneous=True, multi_select=True)
+        self.file_list.callback_selected_add(self._gl_selection_changed_cb)
+        self.file_list.callback_unselected_add(self._gl_selection_changed_cb)
         self.file_list.callback_expand_request_add(self._gl_expand_req_cb)
         self.file_list.callback_contract_request_add(self._gl_contract_req_cb)
         self.file_list.callback_expanded_add(self._gl_expanded_cb)
@@ -227,61 +303,114 @@ class MainWin(StandardWindow):
 
         pop.show()
 
-    def tree_populate(self, file_list=None, parent=None):
-        if file_list is not None:
+    def tree_populate(self, tree=None, parent=None):
+        """ Fill the genlist with the content of the DirTree tree (the one
+            already set if None), or of the folder item parent if given.
+            If tree is already shown (filled by tree_add) only refresh it.
+        """
+        if tree is not None and tree is self._tree:
+            self.file_list.realized_items_update()  # totals now available
+            return
+        if tree is not None:
+            for filler in self._fillers.values():
+                filler.cancel()
             self.file_list.clear()
-            self._file_list = file_list
-
-        if parent is None:
-            prefix = None # items must match this prefix to be listed
-            fscount = 0   # folder must have this number of slashes
-            dscount = 1   # files must have this number of slashes
+            self._tree = tree
+            self._expanded = {}
+            self._fillers = {}
+            self._gl_selection_changed_cb(self.file_list, None)
+
+        node = self._tree.root if parent is None else parent.data
+        filler = TreeFiller(self, parent, node.children or ())
+        if not filler.done:
+            self._fillers[node] = filler
+
+    def tree_item_append(self, node, parent):
+        if node.isdir:
+            self.file_list.item_append(self.fold_itc, node, parent,
+                                       flags=ELM_GENLIST_ITEM_TREE)
         else:
-            prefix = parent.data[:-1]
-            fscount = prefix.count('/') + 1
-            dscount = fscount + 1
-
-        files = []
-        for path in self._file_list:
-            if prefix and not path.startswith(prefix):
+            self.file_list.item_append(self.file_itc, node, parent)
+
+    def tree_add(self, tree, nodes):
+        """ Show the nodes just added to tree while the listing is in
+            progress, only the ones in the visible folders are inserted
+        """
+        if tree is not self._tree:
+            self.tree_populate(tree)
+            return
+        root = tree.root
+        for node in nodes:
+            folder = node.parent
+            if folder == root:
+                parent = None
+            elif folder in self._expanded:
+                parent = self._expanded[folder]
+            else:
                 continue
-
-            if path.endswith('/'):
-                if path.count('/') == dscount:
-                    self.file_list.item_append(self.fold_itc, path, parent,
-                                               flags=ELM_GENLIST_ITEM_TREE)
+            filler = self._fillers.get(folder)
+            if filler is not None and filler.add(node):
+                continue
+            if node.isdir:
+                self.file_list.item_sorted_insert(self.fold_itc, node,
+                                                  _gl_compare, parent,
+                                                  ELM_GENLIST_ITEM_TREE)
             else:
-                if path.count('/') == fscount:
-                    files.append(path)
-
-        for path in files:
-            self.file_list.item_append(self.file_itc, path, parent)
+                self.file_list.item_sorted_insert(self.file_itc, node,
+                                                  _gl_compare, parent)
 
     def _gl_fold_text_get(self, obj, part, item_data):
-        return item_data[:-1].split('/')[-1]
+        if not self._tree.complete:
+            return item_data.name  # totals still unknown
+        return '%s  (%s, %s)' % (
+               item_data.name,
+               ngettext('%d file', '%d files', item_data.file_count) %
+               item_data.file_count,
+               utils.format_size(item_data.size))
 
     def _gl_fold_icon_get(self, obj, part, item_data):
         return SafeIcon(obj, 'folder')
 
     def _gl_file_text_get(self, obj, part, item_data):
-        return item_data.split('/')[-1]
+        return item_data.name
 
     def _gl_expand_req_cb(self, gl, item):
         item.expanded = True
 
     def _gl_expanded_cb(self, gl, item):
+        self._expanded[item.data] = item
         self.tree_populate(None, item)
 
     def _gl_contract_req_cb(self, gl, item):
         item.expanded = False
 
     def _gl_contracted_cb(self, gl, item):
+        # forget the folder and all the open folders inside it
+        for node in list(self._expanded):
+            ancestor = node
+            while ancestor is not None and ancestor != item.data:
+                ancestor = ancestor.parent
+            if ancestor is not None:
+                del self._expanded[node]
+                filler = self._fillers.pop(node, None)
+                if filler is not None:
+                    filler.cancel()
         item.subitems_clear()
 
+    def _gl_selection_changed_cb(self, gl, item):
+        if self.file_list.selected_items:
+            self.extract_btn.text = _('Extract selected')
+        else:
+            self.extract_btn.text = _('Extract')
+
+    def selected_paths(self):
+        """ The paths selected in the tree, folders end with a slash """
+        return [item.data.path for item in self.file_list.selected_items]
+
     def extract_btn_cb(self, btn):
         self.prog_popup = None
         self.app.dest_folder = self.fsb.text
-        self.app.extract_archive()
+        self.app.extract_archive(include=self.selected_paths() or None)
 
     def build_prog_popup(self):
         pp = Popup(self)
@@ -302,21 +431,35 @@ class MainWin(StandardWindow):
         vbox.pack_end(pb)
         pb.show()
 
+        st = Label(self, ellipsis=True, size_hint_weight=EXPAND_HORIZ,
+                   size_hint_align=FILL_HORIZ)
+        vbox.pack_end(st)
+        st.show()
+
         bt = Button(pp, text=_('Cancel'))
         bt.callback_clicked_add(lambda b: self.app.abort_operation())
         pp.part_content_set('button1', bt)
 
         self.prog_pbar = pb
         self.prog_label = lb
+        self.prog_stats = st
         self.prog_popup = pp
 
-    def extract_progress(self, progress, cur_name):
+    def extract_progress(self, progress, cur_name, stats=None):
         if self.prog_popup is None:
             self.build_prog_popup()
 
         self.prog_pbar.value = progress
         self.prog_label.text = cur_name
 
+        if stats is not None:
+            txt = _('%s/s') % utils.format_size(stats.bytes_rate)
+            if stats.entries_rate > 0:
+                txt += ' - ' + _('%d files/s') % stats.entries_rate
+            if stats.eta is not None:
+                txt += ' - ' + _('%s left') % utils.format_time(stats.eta)
+            self.prog_stats.text = '<small>%s</small>' % txt
+
     def extract_finished(self):
         if self.prog_popup:
             self.prog_popup.delete()
@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+# encoding: utf-8
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+import io
+import os
+import time
+import hashlib
+
+from epack.listcache import archive_identity
+
+
+# the journal file in the destination, followed by a hash of the archive
+# path (many archives can be extracted in the same place)
+JOURNAL_PREFIX = '.epack-journal-'
+
+# bump when the format change
+JOURNAL_VERSION = 1
+
+# the offset reached in the file being written is recorded every
+# PART_INTERVAL bytes
+PART_INTERVAL = 16 * 1024 * 1024
+
+# the completed entries are written to the journal at least this often
+# (seconds), the offsets at once
+FLUSH_INTERVAL = 1.0
+
+# on resume, the data before the recorded offset is trusted but for this
+# last piece, compared with the archive
+VERIFY_SIZE = 1024 * 1024
+
+
+class Journal(object):
+    """ What an extraction has done so far, in a small text file in the
+        destination, so that it can be resumed after a stop or a crash:
+
+            epack-journal <version> <archive identity>
+            done <index>             the entry at index is extracted
+            part <index> <offset>    the entry is written up to offset
+
+        It is appended to as the entries are done, and removed at the end
+        of a successful extraction. A journal of another archive (or of a
+        changed one) is ignored.
+
+        The entries are done once handed to the kernel: the journal
+        survives a killed process; with an os crash it is only safe with
+        the SYNC_FILE durability policy.
+    """
+    def __init__(self, destination, archive_file):
+        key = hashlib.sha1(os.path.abspath(archive_file).encode('utf-8',
+                                                                'replace'))
+        self.path = os.path.join(destination,
+                                 JOURNAL_PREFIX + key.hexdigest()[:16])
+        self.header = 'epack-journal %d %s\n' % (
+                      JOURNAL_VERSION,
+                      ' '.join(str(v) for v in archive_identity(archive_file)))
+        self.done = set()  # indices of the entries extracted
+        self.partial = {}  # index: offset, of the entry being written
+        self._file = None
+        self._flush_time = 0
+
+    def load(self):
+        """ Read the journal left in the destination by a previous
+            extraction of the same archive, return True if there is one
+        """
+        try:
+            with io.open(self.path, 'r', encoding='utf-8') as f:
+                if f.readline() != self.header:
+                    return False
+                for line in f:
+                    fields = line.split()
+                    try:
+                        if fields[0] == 'done' and len(fields) == 2:
+                            index = int(fields[1])
+                            self.done.add(index)
+                            self.partial.pop(index, None)
+                        elif fields[0] == 'part' and len(fields) == 3:
+                            self.partial[int(fields[1])] = int(fields[2])
+                    except (IndexError, ValueError):
+                        pass  # the last line, cut by a crash
+        except EnvironmentError:
+            return False
+        return True
+
+    def open(self):
+        """ Start journaling, after what was loaded (if anything) """
+        self._file = io.open(self.path, 'w', encoding='utf-8')
+        self._file.write(self.header)
+        # what was loaded is written again: the old file may end with a
+        # broken line
+        for index in sorted(self.done):
+            self._file.write('done %d\n' % index)
+        for index, offset in sorted(self.partial.items()):
+            self._file.write('part %d %d\n' % (index, offset))
+        self._file.flush()
+        self._flush_time = time.time()
+
+    def entry_done(self, index):
+        self._file.write('done %d\n' % index)
+        now = time.time()
+        if now - self._flush_time > FLUSH_INTERVAL:
+            self._file.flush()
+            self._flush_time = now
+
+    def entry_part(self, index, offset):
+        self._file.write('part %d %d\n' % (index, offset))
+        self._file.flush()
+        self._flush_time = time.time()
+
+    def close(self, remove=False):
+        """ Stop journaling, with remove the journal is deleted (all done) """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if remove:
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+
+
+class JournalOutput(object):
+    """ Same interface of DiskOutput, that it wraps: entry(index) is called
+        before the operations of each file or link (not the folders, their
+        metadata is applied at the end, they are always done again), the
+        entry is recorded in the journal when the next one begins, or at
+        the end. An entry interrupted by an error is not.
+    """
+    def __init__(self, output, journal, part_interval=PART_INTERVAL):
+        self.output = output
+        self.journal = journal
+        self.part_interval = part_interval
+        self._index = None               # the entry in progress
+        self._next_part = part_interval  # offset of the next part record
+
+    def entry(self, index):
+        self._done()
+        self._index = index
+        self._next_part = self.part_interval
+
+    def folder(self, *args):
+        self.output.folder(*args)
+
+    def symlink(self, *args):
+        self.output.symlink(*args)
+
+    def hardlink(self, *args):
+        self.output.hardlink(*args)
+
+    def metadata(self, *args):
+        self.output.metadata(*args)
+
+    def open(self, *args):
+        self.output.open(*args)
+
+    def write(self, offset, data):
+        self.output.write(offset, data)
+        if offset + len(data) >= self._next_part:
+            flushed = self.output.flushed()
+            if flushed:
+                self.journal.entry_part(self._index, flushed)
+            self._next_part = offset + len(data) + self.part_interval
+
+    def reflink(self, source):
+        self.output.reflink(source)
+
+    def flushed(self):
+        return self.output.flushed()
+
+    def close(self, size):
+        self.output.close(size)
+
+    def finish(self):
+        self._done()
+        self.output.finish()
+
+    def abort(self):
+        self.output.abort()
+
+    def _done(self):
+        if self._index is not None:
+            self.journal.entry_done(self._index)
+            self._index = None
@@ -5,12 +5,18 @@
 
 from .entry import ArchiveEntry
 from .exception import ArchiveError
-from .read import fd_reader, file_reader, memory_reader
+from .extract import disk_writer, extract_entries, parse_flags
+from .read import (
+    custom_reader, fd_reader, file_reader, memory_reader, mmap_reader,
+    stream_reader
+)
 from .write import custom_writer, fd_writer, file_writer, memory_writer
 
 __all__ = [
     ArchiveEntry,
     ArchiveError,
-    fd_reader, file_reader, memory_reader,
+    disk_writer, extract_entries, parse_flags,
+    custom_reader, fd_reader, file_reader, memory_reader, mmap_reader,
+    stream_reader,
     custom_writer, fd_writer, file_writer, memory_writer
 ]
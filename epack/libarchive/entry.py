@@ -6,9 +6,13 @@
 from __future__ import division, print_function, unicode_literals
 
 from contextlib import contextmanager
-from ctypes import c_char_p, create_string_buffer
+from ctypes import (
+    byref, c_char, c_char_p, c_longlong, c_size_t, c_void_p,
+    create_string_buffer,
+)
 
 from . import ffi
+from .ffi import ARCHIVE_EOF
 
 
 @contextmanager
@@ -33,7 +37,13 @@ class ArchiveEntry(object):
     def filetype(self):
         return ffi.entry_filetype(self._entry_p)
 
-    def get_blocks(self, block_size=ffi.page_size):
+    def get_blocks(self, block_size=None):
+        """Iterates through the entry data, yielding copies as bytes.
+
+        When block_size is not given it is chosen from the entry size.
+        """
+        if block_size is None:
+            block_size = ffi.adaptive_block_size(self.size)
         archive_p = self._archive_p
         buf = create_string_buffer(block_size)
         read = ffi.read_data
@@ -43,9 +53,68 @@ class ArchiveEntry(object):
                 break
             yield buf.raw[0:r]
 
+    def get_data_blocks(self):
+        """Iterates through the entry data without copying it.
+
+        Yields (offset, memoryview) tuples. The view points into a buffer
+        owned by libarchive and is only valid until the next iteration.
+        The offset is the position of the block inside the entry, on sparse
+        entries it can jump forward over holes.
+        """
+        for offset, address, size in self._iter_data_blocks():
+            if size:
+                yield offset, memoryview((c_char * size).from_address(address))
+            else:
+                yield offset, memoryview(b'')
+
+    def skip_data(self):
+        """Skip the entry data, where the format allows it without even
+        decompressing it.
+        """
+        ffi.read_data_skip(self._archive_p)
+
+    def _iter_data_blocks(self):
+        archive_p = self._archive_p
+        read_data_block = ffi.read_data_block
+        buf_p = c_void_p()
+        size = c_size_t()
+        offset = c_longlong()
+        buf_ref, size_ref, offset_ref = byref(buf_p), byref(size), byref(offset)
+        while 1:
+            r = read_data_block(archive_p, buf_ref, size_ref, offset_ref)
+            if r == ARCHIVE_EOF:
+                break
+            yield offset.value, buf_p.value, size.value
+
     @property
     def isdir(self):
-        return bool(self.filetype & ffi.AE_IFDIR)
+        return self.filetype & ffi.AE_IFMT == ffi.AE_IFDIR
+
+    @property
+    def isreg(self):
+        return self.filetype & ffi.AE_IFMT == ffi.AE_IFREG
+
+    @property
+    def issym(self):
+        return self.filetype & ffi.AE_IFMT == ffi.AE_IFLNK
+
+    @property
+    def islnk(self):
+        return self.hardlink is not None
+
+    @property
+    def hardlink(self):
+        """The pathname of the entry this one is a hard link to, or None"""
+        return ffi.entry_hardlink_w(self._entry_p)
+
+    @property
+    def symlink(self):
+        """The target of a symbolic link entry, or None"""
+        return ffi.entry_symlink_w(self._entry_p)
+
+    @property
+    def issparse(self):
+        return ffi.entry_sparse_count(self._entry_p) > 0
 
     @property
     def mtime(self):
@@ -55,6 +124,14 @@ class ArchiveEntry(object):
     def perm(self):
         return ffi.entry_perm(self._entry_p)
 
+    @property
+    def uid(self):
+        return ffi.entry_uid(self._entry_p)
+
+    @property
+    def gid(self):
+        return ffi.entry_gid(self._entry_p)
+
     @property
     def pathname(self):
         return ffi.entry_pathname_w(self._entry_p)
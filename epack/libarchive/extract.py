@@ -0,0 +1,149 @@
+# This file is part of a program licensed under the terms of the GNU Lesser
+# General Public License version 2 (or at your option any later version)
+# as published by the Free Software Foundation: http://www.gnu.org/licenses/
+
+
+from __future__ import division, print_function, unicode_literals
+
+from contextlib import contextmanager
+from os.path import join, realpath
+
+from . import ffi
+from .exception import ArchiveError
+from .ffi import ARCHIVE_FAILED
+
+
+EXTRACT_OWNER = 0x0001
+EXTRACT_PERM = 0x0002
+EXTRACT_TIME = 0x0004
+EXTRACT_NO_OVERWRITE = 0x0008
+EXTRACT_UNLINK = 0x0010
+EXTRACT_ACL = 0x0020
+EXTRACT_FFLAGS = 0x0040
+EXTRACT_XATTR = 0x0080
+EXTRACT_SECURE_SYMLINKS = 0x0100
+EXTRACT_SECURE_NODOTDOT = 0x0200
+EXTRACT_NO_AUTODIR = 0x0400
+EXTRACT_NO_OVERWRITE_NEWER = 0x0800
+EXTRACT_SPARSE = 0x1000
+
+# flag names, as accepted by parse_flags()
+EXTRACT_FLAGS = {
+    'owner': EXTRACT_OWNER,
+    'perm': EXTRACT_PERM,
+    'time': EXTRACT_TIME,
+    'no-overwrite': EXTRACT_NO_OVERWRITE,
+    'unlink': EXTRACT_UNLINK,
+    'acl': EXTRACT_ACL,
+    'fflags': EXTRACT_FFLAGS,
+    'xattr': EXTRACT_XATTR,
+    'secure-symlinks': EXTRACT_SECURE_SYMLINKS,
+    'secure-nodotdot': EXTRACT_SECURE_NODOTDOT,
+    'no-autodir': EXTRACT_NO_AUTODIR,
+    'no-overwrite-newer': EXTRACT_NO_OVERWRITE_NEWER,
+    'sparse': EXTRACT_SPARSE,
+}
+
+DEFAULT_FLAGS = EXTRACT_PERM | EXTRACT_TIME | \
+                EXTRACT_SECURE_SYMLINKS | EXTRACT_SECURE_NODOTDOT
+
+
+def parse_flags(names):
+    """Converts a comma separated string (or a list) of flag names to the
+    flags bitmask used by archive_write_disk.
+    """
+    if not isinstance(names, (list, tuple)):
+        names = names.split(',')
+    flags = 0
+    for name in names:
+        name = name.strip()
+        if name:
+            try:
+                flags |= EXTRACT_FLAGS[name]
+            except KeyError:
+                raise ValueError('unknown extract flag "%s"' % name)
+    return flags
+
+
+class ArchiveWriteDisk(object):
+
+    def __init__(self, archive_p, destination):
+        self._pointer = archive_p
+        # resolved: with the secure-symlinks flag libarchive refuses to
+        # write through any symlink in the path, the destination's too
+        self.destination = realpath(destination)
+        self.failed = []  # messages of the entries refused
+
+    def write_entry(self, entry):
+        """Write the given entry to disk, inside the destination folder.
+
+        This is a generator, it yields the size of every data block written
+        so that the caller can report progress or stop between blocks.
+        Entries refused by libarchive (ex: existing files with the
+        no-overwrite flag) are skipped with a warning, their messages are
+        added to failed.
+        """
+        write_p = self._pointer
+        entry_p = entry._entry_p
+
+        # libarchive writes relative to the cwd, that is shared by all the
+        # threads, so make the paths absolute instead of chdir()
+        pathname = entry.pathname
+        entry.pathname = join(self.destination, pathname.lstrip('/'))
+        hardlink = ffi.entry_hardlink_w(entry_p)
+        if hardlink:
+            hardlink = join(self.destination, hardlink.lstrip('/'))
+            ffi.entry_update_hardlink_utf8(entry_p, hardlink.encode('utf8'))
+
+        try:
+            ffi.write_header(write_p, entry_p)
+        except ArchiveError as e:
+            if e.retcode != ARCHIVE_FAILED:
+                raise
+            msg = e.msg
+            if isinstance(msg, bytes):
+                msg = msg.decode('utf-8', 'replace')
+            ffi.logger.warning(msg)
+            self.failed.append('%s: %s' % (pathname, msg))
+            return
+
+        write_data_block = ffi.write_data_block
+        for offset, address, size in entry._iter_data_blocks():
+            if size:
+                write_data_block(write_p, address, size, offset)
+            yield size
+        ffi.write_finish_entry(write_p)
+
+    def add_entries(self, entries):
+        """Write all the given entries to disk.
+        """
+        for entry in entries:
+            for size in self.write_entry(entry):
+                pass
+
+
+@contextmanager
+def new_archive_write_disk(flags):
+    archive_p = ffi.write_disk_new()
+    try:
+        ffi.write_disk_set_options(archive_p, flags)
+        ffi.write_disk_set_standard_lookup(archive_p)
+        yield archive_p
+    finally:
+        ffi.write_close(archive_p)
+        ffi.write_free(archive_p)
+
+
+@contextmanager
+def disk_writer(destination, flags=DEFAULT_FLAGS):
+    """Write entries to disk using archive_write_disk.
+    """
+    with new_archive_write_disk(flags) as archive_p:
+        yield ArchiveWriteDisk(archive_p, destination)
+
+
+def extract_entries(entries, destination, flags=DEFAULT_FLAGS):
+    """Extract the given entries into the destination folder.
+    """
+    with disk_writer(destination, flags) as disk:
+        disk.add_entries(entries)
@@ -16,23 +16,68 @@ except ImportError:
     from ctypes import c_longlong as c_ssize_t
 
 import ctypes
-from ctypes.util import find_library
-import logging
 import mmap
 import os
+import sys
 
 from .exception import ArchiveError
 
 
-logger = logging.getLogger('libarchive')
-
 page_size = mmap.PAGESIZE
+max_block_size = 1024 * 1024
+
+
+def adaptive_block_size(size):
+    """Returns a block size suited to read `size` bytes: a multiple of the
+    page size, never smaller than a page nor bigger than max_block_size.
+    """
+    if not size or size <= page_size:
+        return page_size
+    size = (size + page_size - 1) // page_size * page_size
+    return min(size, max_block_size)
+
+
+# Lazy loading
+#
+# Nothing is looked up in the library at import time: the library itself,
+# the logger and every archive_* function are loaded the first time they
+# are used, through the module __getattr__ (PEP 562). Older pythons bind
+# everything at the end of the module.
+
+# the usual sonames, tried before the (slow) ctypes.util.find_library
+SONAMES = ('libarchive.so.13', 'libarchive.13.dylib')
+
+
+def _open_library():
+    path = os.environ.get('LIBARCHIVE')
+    if not path:
+        for soname in SONAMES:
+            try:
+                return soname, ctypes.cdll.LoadLibrary(soname)
+            except OSError:
+                pass
+        from ctypes.util import find_library
+        path = find_library('archive') or find_library('libarchive') or \
+               'libarchive.so'
+    return path, ctypes.cdll.LoadLibrary(path)
+
+
+def _load_library():
+    lib = globals().get('libarchive')
+    if lib is None:
+        path, lib = _open_library()
+        globals().update(libarchive_path=path, libarchive=lib)
+    return lib
+
+
+def _library_path():
+    _load_library()
+    return globals()['libarchive_path']
 
-libarchive_path = os.environ.get('LIBARCHIVE') or \
-                  find_library('archive') or \
-                  find_library('libarchive') or \
-                  'libarchive.so'
-libarchive = ctypes.cdll.LoadLibrary(libarchive_path)
+
+def _get_logger():
+    import logging
+    return logging.getLogger('libarchive')
 
 
 # Constants
@@ -44,6 +89,15 @@ ARCHIVE_WARN = -20    # Partial success.
 ARCHIVE_FAILED = -25  # Current operation cannot complete.
 ARCHIVE_FATAL = -30   # No more operations are possible.
 
+ARCHIVE_FORMAT_BASE_MASK = 0xff0000
+ARCHIVE_FORMAT_CPIO = 0x10000
+ARCHIVE_FORMAT_TAR = 0x30000
+ARCHIVE_FORMAT_ISO9660 = 0x40000
+ARCHIVE_FORMAT_ZIP = 0x50000
+ARCHIVE_FORMAT_7ZIP = 0xE0000
+
+ARCHIVE_FILTER_NONE = 0
+
 AE_IFMT = 0o170000
 AE_IFREG = 0o100000
 AE_IFLNK = 0o120000
@@ -59,6 +113,13 @@ AE_IFIFO = 0o010000
 WRITE_CALLBACK = CFUNCTYPE(
     c_ssize_t, c_void_p, c_void_p, POINTER(c_void_p), c_size_t
 )
+READ_CALLBACK = CFUNCTYPE(
+    c_ssize_t, c_void_p, c_void_p, POINTER(c_void_p)
+)
+SKIP_CALLBACK = CFUNCTYPE(c_longlong, c_void_p, c_void_p, c_longlong)
+SEEK_CALLBACK = CFUNCTYPE(
+    c_longlong, c_void_p, c_void_p, c_longlong, c_int
+)
 OPEN_CALLBACK = CFUNCTYPE(c_int, c_void_p, c_void_p)
 CLOSE_CALLBACK = CFUNCTYPE(c_int, c_void_p, c_void_p)
 VOID_CB = lambda *_: ARCHIVE_OK
@@ -73,7 +134,7 @@ c_archive_entry_p = c_void_p
 # Helper functions
 
 def _error_string(archive_p):
-    msg = error_string(archive_p)
+    msg = _func('error_string')(archive_p)
     if msg is None:
         return
     try:
@@ -84,7 +145,7 @@ def _error_string(archive_p):
 
 def archive_error(archive_p, retcode):
     msg = _error_string(archive_p)
-    raise ArchiveError(msg, errno(archive_p), retcode, archive_p)
+    raise ArchiveError(msg, _func('errno')(archive_p), retcode, archive_p)
 
 
 def check_null(ret, func, args):
@@ -97,14 +158,23 @@ def check_int(retcode, func, args):
     if retcode >= 0:
         return retcode
     elif retcode == ARCHIVE_WARN:
-        logger.warning(_error_string(args[0]))
+        _lazy('logger').warning(_error_string(args[0]))
         return retcode
     else:
         raise archive_error(args[0], retcode)
 
 
+_declarations = {}  # name: (argtypes, restype, errcheck)
+
+
 def ffi(name, argtypes, restype, errcheck=None):
-    f = getattr(libarchive, 'archive_'+name)
+    """Declare the archive_<name> function, looked up on first use"""
+    _declarations[name] = (argtypes, restype, errcheck)
+
+
+def _bind(name):
+    argtypes, restype, errcheck = _declarations[name]
+    f = getattr(_load_library(), 'archive_'+name)
     f.argtypes = argtypes
     f.restype = restype
     if errcheck:
@@ -113,12 +183,57 @@ def ffi(name, argtypes, restype, errcheck=None):
     return f
 
 
+def _func(name):
+    return globals().get(name) or _bind(name)
+
+
+def _supported(prefix, names):
+    """The names whose prefix_name function exists in the library"""
+    lib = _load_library()
+    result = set()
+    for f_name in names:
+        if hasattr(lib, 'archive_'+prefix+f_name):
+            result.add(f_name)
+        else:  # pragma: no cover
+            _lazy('logger').warning('"%s%s" is not supported' %
+                                    (prefix, f_name))
+    return result
+
+
+_LAZY = {
+    'libarchive': _load_library,
+    'libarchive_path': _library_path,
+    'logger': _get_logger,
+    'READ_FORMATS': lambda: _supported('read_support_format_',
+                                       _READ_FORMATS),
+    'READ_FILTERS': lambda: _supported('read_support_filter_',
+                                       _READ_FILTERS),
+    'WRITE_FORMATS': lambda: _supported('write_set_format_', _WRITE_FORMATS),
+    'WRITE_FILTERS': lambda: _supported('write_add_filter_', _WRITE_FILTERS),
+}
+
+
+def _lazy(name):
+    value = globals().get(name)
+    if value is None:
+        value = globals()[name] = _LAZY[name]()
+    return value
+
+
+def __getattr__(name):
+    if name in _LAZY:
+        return _lazy(name)
+    if name in _declarations:
+        return _bind(name)
+    raise AttributeError('module %r has no attribute %r' % (__name__, name))
+
+
 # FFI declarations
 
 # archive_util
 
-errno = ffi('errno', [c_archive_p], c_int)
-error_string = ffi('error_string', [c_archive_p], c_char_p)
+ffi('errno', [c_archive_p], c_int)
+ffi('error_string', [c_archive_p], c_char_p)
 
 # archive_entry
 
@@ -131,8 +246,15 @@ ffi('entry_pathname_w', [c_archive_entry_p], c_wchar_p)
 ffi('entry_sourcepath', [c_archive_entry_p], c_char_p)
 ffi('entry_size', [c_archive_entry_p], c_longlong)
 ffi('entry_size_is_set', [c_archive_entry_p], c_int)
+ffi('entry_sparse_count', [c_archive_entry_p], c_int)
+ffi('entry_uid', [c_archive_entry_p], c_longlong)
+ffi('entry_gid', [c_archive_entry_p], c_longlong)
+
+ffi('entry_hardlink_w', [c_archive_entry_p], c_wchar_p)
+ffi('entry_symlink_w', [c_archive_entry_p], c_wchar_p)
 
 ffi('entry_update_pathname_utf8', [c_archive_entry_p, c_char_p], None)
+ffi('entry_update_hardlink_utf8', [c_archive_entry_p, c_char_p], None)
 
 ffi('entry_clear', [c_archive_entry_p], c_archive_entry_p)
 ffi('entry_free', [c_archive_entry_p], None)
@@ -141,36 +263,44 @@ ffi('entry_free', [c_archive_entry_p], None)
 
 ffi('read_new', [], c_archive_p, check_null)
 
-READ_FORMATS = set((
+_READ_FORMATS = (
     '7zip', 'all', 'ar', 'cab', 'cpio', 'empty', 'iso9660', 'lha', 'mtree',
     'rar', 'raw', 'tar', 'xar', 'zip'
-))
-for f_name in list(READ_FORMATS):
-    try:
-        ffi('read_support_format_'+f_name, [c_archive_p], c_int, check_int)
-    except AttributeError:  # pragma: no cover
-        logger.warning('read format "%s" is not supported' % f_name)
-        READ_FORMATS.remove(f_name)
+)
+for f_name in _READ_FORMATS:
+    ffi('read_support_format_'+f_name, [c_archive_p], c_int, check_int)
 
-READ_FILTERS = set((
+_READ_FILTERS = (
     'all', 'bzip2', 'compress', 'grzip', 'gzip', 'lrzip', 'lzip', 'lzma',
     'lzop', 'none', 'rpm', 'uu', 'xz'
-))
-for f_name in list(READ_FILTERS):
-    try:
-        ffi('read_support_filter_'+f_name, [c_archive_p], c_int, check_int)
-    except AttributeError:  # pragma: no cover
-        logger.warning('read filter "%s" is not supported' % f_name)
-        READ_FILTERS.remove(f_name)
+)
+for f_name in _READ_FILTERS:
+    ffi('read_support_filter_'+f_name, [c_archive_p], c_int, check_int)
 
 ffi('read_open_fd', [c_archive_p, c_int, c_size_t], c_int, check_int)
 ffi('read_open_filename_w', [c_archive_p, c_wchar_p, c_size_t],
     c_int, check_int)
 ffi('read_open_memory', [c_archive_p, c_void_p, c_size_t], c_int, check_int)
 
+ffi('read_set_open_callback', [c_archive_p, OPEN_CALLBACK], c_int, check_int)
+ffi('read_set_read_callback', [c_archive_p, READ_CALLBACK], c_int, check_int)
+ffi('read_set_skip_callback', [c_archive_p, SKIP_CALLBACK], c_int, check_int)
+ffi('read_set_seek_callback', [c_archive_p, SEEK_CALLBACK], c_int, check_int)
+ffi('read_set_close_callback', [c_archive_p, CLOSE_CALLBACK],
+    c_int, check_int)
+ffi('read_set_callback_data', [c_archive_p, c_void_p], c_int, check_int)
+ffi('read_open1', [c_archive_p], c_int, check_int)
+
 ffi('read_next_header', [c_archive_p, POINTER(c_void_p)], c_int, check_int)
 ffi('read_next_header2', [c_archive_p, c_void_p], c_int, check_int)
 
+ffi('read_header_position', [c_archive_p], c_longlong)
+
+ffi('filter_bytes', [c_archive_p, c_int], c_longlong)
+ffi('filter_code', [c_archive_p, c_int], c_int)
+ffi('filter_count', [c_archive_p], c_int)
+ffi('format', [c_archive_p], c_int)
+
 ffi('read_close', [c_archive_p], c_int, check_int)
 ffi('read_free', [c_archive_p], c_int, check_int)
 
@@ -196,29 +326,22 @@ ffi('write_new', [], c_archive_p, check_null)
 
 ffi('write_disk_new', [], c_archive_p, check_null)
 ffi('write_disk_set_options', [c_archive_p, c_int], c_int, check_int)
+ffi('write_disk_set_standard_lookup', [c_archive_p], c_int, check_int)
 
-WRITE_FORMATS = set((
+_WRITE_FORMATS = (
     '7zip', 'ar_bsd', 'ar_svr4', 'cpio', 'cpio_newc', 'gnutar', 'iso9660',
     'mtree', 'mtree_classic', 'pax', 'pax_restricted', 'shar', 'shar_dump',
     'ustar', 'v7tar', 'xar', 'zip'
-))
-for f_name in list(WRITE_FORMATS):
-    try:
-        ffi('write_set_format_'+f_name, [c_archive_p], c_int, check_int)
-    except AttributeError:  # pragma: no cover
-        logger.warning('write format "%s" is not supported' % f_name)
-        WRITE_FORMATS.remove(f_name)
+)
+for f_name in _WRITE_FORMATS:
+    ffi('write_set_format_'+f_name, [c_archive_p], c_int, check_int)
 
-WRITE_FILTERS = set((
+_WRITE_FILTERS = (
     'b64encode', 'bzip2', 'compress', 'grzip', 'gzip', 'lrzip', 'lzip', 'lzma',
     'lzop', 'uuencode', 'xz'
-))
-for f_name in list(WRITE_FILTERS):
-    try:
-        ffi('write_add_filter_'+f_name, [c_archive_p], c_int, check_int)
-    except AttributeError:  # pragma: no cover
-        logger.warning('write filter "%s" is not supported' % f_name)
-        WRITE_FILTERS.remove(f_name)
+)
+for f_name in _WRITE_FILTERS:
+    ffi('write_add_filter_'+f_name, [c_archive_p], c_int, check_int)
 
 ffi('write_open',
     [c_archive_p, c_void_p, OPEN_CALLBACK, WRITE_CALLBACK, CLOSE_CALLBACK],
@@ -243,3 +366,13 @@ ffi('write_finish_entry', [c_archive_p], c_int, check_int)
 
 ffi('write_close', [c_archive_p], c_int, check_int)
 ffi('write_free', [c_archive_p], c_int, check_int)
+
+
+if sys.version_info < (3, 7):  # pragma: no cover, no module __getattr__
+    for name in list(_declarations):
+        try:
+            _bind(name)
+        except AttributeError:
+            pass
+    for name in _LAZY:
+        _lazy(name)
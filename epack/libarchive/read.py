@@ -6,11 +6,13 @@
 from __future__ import division, print_function, unicode_literals
 
 from contextlib import contextmanager
-from ctypes import cast, c_void_p
-from os import fstat, stat
+from ctypes import addressof, cast, c_char, c_void_p, create_string_buffer
+from os import fstat, stat, SEEK_CUR, SEEK_END
+import mmap
+import os
 
 from . import ffi
-from .ffi import ARCHIVE_EOF
+from .ffi import ARCHIVE_EOF, ARCHIVE_FATAL, page_size
 from .entry import ArchiveEntry, new_archive_entry
 
 
@@ -32,6 +34,41 @@ class ArchiveRead(object):
                     return
                 yield entry
 
+    @property
+    def bytes_read(self):
+        """Number of bytes consumed so far from the (compressed) input.
+        """
+        return ffi.filter_bytes(self._pointer, -1)
+
+    @property
+    def header_position(self):
+        """Offset of the current entry header in the uncompressed data.
+        """
+        return ffi.read_header_position(self._pointer)
+
+    @property
+    def format(self):
+        """Format code of the archive (ARCHIVE_FORMAT_*), valid after the
+        first header has been read.
+        """
+        return ffi.format(self._pointer)
+
+    @property
+    def filters(self):
+        """Codes of the filters (ARCHIVE_FILTER_*) in use, outermost first.
+        """
+        p = self._pointer
+        return [ffi.filter_code(p, i) for i in range(ffi.filter_count(p))]
+
+
+def _reader_block_size(stat_func, target):
+    try:
+        st = stat_func(target)
+    except OSError:  # pragma: no cover
+        return page_size
+    return max(ffi.adaptive_block_size(st.st_size),
+               getattr(st, 'st_blksize', page_size))
+
 
 @contextmanager
 def new_archive_read(format_name='all', filter_name='all'):
@@ -49,31 +86,177 @@ def new_archive_read(format_name='all', filter_name='all'):
 
 
 @contextmanager
-def fd_reader(fd, format_name='all', filter_name='all', block_size=4096):
+def fd_reader(fd, format_name='all', filter_name='all', block_size=None):
     """Read an archive from a file descriptor.
+
+    When block_size is not given it is chosen from the archive size.
     """
     with new_archive_read(format_name, filter_name) as archive_p:
-        try:
-            block_size = fstat(fd).st_blksize
-        except (OSError, AttributeError):  # pragma: no cover
-            pass
+        if block_size is None:
+            block_size = _reader_block_size(fstat, fd)
         ffi.read_open_fd(archive_p, fd, block_size)
         yield ArchiveRead(archive_p)
 
 
 @contextmanager
-def file_reader(path, format_name='all', filter_name='all', block_size=4096):
+def file_reader(path, format_name='all', filter_name='all', block_size=None):
     """Read an archive from a file.
+
+    When block_size is not given it is chosen from the archive size.
     """
     with new_archive_read(format_name, filter_name) as archive_p:
-        try:
-            block_size = stat(path).st_blksize
-        except (OSError, AttributeError):  # pragma: no cover
-            pass
+        if block_size is None:
+            block_size = _reader_block_size(stat, path)
         ffi.read_open_filename_w(archive_p, path, block_size)
         yield ArchiveRead(archive_p)
 
 
+@contextmanager
+def custom_reader(read_func, format_name='all', filter_name='all',
+                  skip_func=None, seek_func=None, open_func=None,
+                  close_func=None):
+    """Read an archive using python callbacks.
+
+    The callbacks have the libarchive signatures, the first two arguments
+    are the archive pointer and the (unused) client data:
+    read_func(archive_p, data, ptrptr) stores the address of the next block
+    in ptrptr[0] and returns its size, 0 at the end of the input;
+    skip_func(archive_p, data, request) returns the number of bytes
+    skipped; seek_func(archive_p, data, offset, whence) returns the new
+    position. On failure they must return ARCHIVE_FATAL.
+    """
+    # keep the C callbacks alive until the archive is freed
+    callbacks = [ffi.READ_CALLBACK(read_func)]
+    with new_archive_read(format_name, filter_name) as archive_p:
+        ffi.read_set_read_callback(archive_p, callbacks[-1])
+        if skip_func:
+            callbacks.append(ffi.SKIP_CALLBACK(skip_func))
+            ffi.read_set_skip_callback(archive_p, callbacks[-1])
+        if seek_func:
+            callbacks.append(ffi.SEEK_CALLBACK(seek_func))
+            ffi.read_set_seek_callback(archive_p, callbacks[-1])
+        if open_func:
+            callbacks.append(ffi.OPEN_CALLBACK(open_func))
+            ffi.read_set_open_callback(archive_p, callbacks[-1])
+        if close_func:
+            callbacks.append(ffi.CLOSE_CALLBACK(close_func))
+            ffi.read_set_close_callback(archive_p, callbacks[-1])
+        # read_open1 needs the client data set, even if unused
+        ffi.read_set_callback_data(archive_p, None)
+        ffi.read_open1(archive_p)
+        yield ArchiveRead(archive_p)
+
+
+class MmapSource(object):
+    """The read, skip and seek callbacks over a memory mapped file.
+
+    Blocks are given to libarchive straight from the mapping, skipping and
+    seeking only move the position.
+    """
+
+    def __init__(self, fd, block_size=None):
+        self.size = fstat(fd).st_size
+        # a private mapping, as ctypes needs a writable buffer (pages are
+        # never written, so never copied)
+        self._map = mmap.mmap(fd, self.size, access=mmap.ACCESS_COPY)
+        self._buf = (c_char * self.size).from_buffer(self._map)
+        self._address = addressof(self._buf)
+        self.block_size = block_size or ffi.max_block_size
+        self.pos = 0
+
+    def close(self):
+        del self._buf  # release the exported buffer
+        self._map.close()
+
+    def read(self, archive_p, data, ptrptr):
+        size = min(self.block_size, self.size - self.pos)
+        ptrptr[0] = self._address + self.pos
+        self.pos += size
+        return size
+
+    def skip(self, archive_p, data, request):
+        request = min(request, self.size - self.pos)
+        self.pos += request
+        return request
+
+    def seek(self, archive_p, data, offset, whence):
+        if whence == SEEK_CUR:
+            offset += self.pos
+        elif whence == SEEK_END:
+            offset += self.size
+        if offset < 0:
+            return ARCHIVE_FATAL
+        self.pos = min(offset, self.size)
+        return self.pos
+
+
+@contextmanager
+def stream_reader(stream, format_name='all', filter_name='all',
+                  block_size=None):
+    """Read an archive from a python file-like object.
+
+    The stream needs a readinto() method; if it also has seek() and tell()
+    libarchive can skip and seek on it.
+    """
+    block_size = block_size or ffi.max_block_size
+    buf = create_string_buffer(block_size)
+    buf_p = cast(buf, c_void_p).value
+
+    def read(archive_p, data, ptrptr):
+        try:
+            ptrptr[0] = buf_p
+            return stream.readinto(buf)
+        except Exception:
+            return ARCHIVE_FATAL
+
+    def skip(archive_p, data, request):
+        try:
+            pos = stream.tell()
+            return stream.seek(pos + request) - pos
+        except Exception:
+            return ARCHIVE_FATAL
+
+    def seek(archive_p, data, offset, whence):
+        try:
+            return stream.seek(offset, whence)
+        except Exception:
+            return ARCHIVE_FATAL
+
+    seekable = hasattr(stream, 'seek') and hasattr(stream, 'tell')
+    with custom_reader(read, format_name, filter_name,
+                       skip_func=skip if seekable else None,
+                       seek_func=seek if seekable else None) as archive:
+        yield archive
+
+
+@contextmanager
+def mmap_reader(path, format_name='all', filter_name='all', block_size=None):
+    """Read an archive file through a memory mapping, with seek support.
+
+    Files that cannot be mapped (empty, not regular, ...) are read by
+    file_reader instead.
+    """
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        source = MmapSource(fd, block_size)
+    except (EnvironmentError, ValueError, OverflowError):
+        source = None
+    finally:
+        os.close(fd)  # the mapping stays valid
+
+    if source is None:
+        with file_reader(path, format_name, filter_name, block_size) as a:
+            yield a
+        return
+    try:
+        with custom_reader(source.read, format_name, filter_name,
+                           skip_func=source.skip,
+                           seek_func=source.seek) as archive:
+            yield archive
+    finally:
+        source.close()
+
+
 @contextmanager
 def memory_reader(buf, format_name='all', filter_name='all'):
     """Read an archive from memory.
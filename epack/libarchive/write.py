@@ -14,20 +14,28 @@ from .entry import ArchiveEntry, new_archive_entry
 from .ffi import (
     OPEN_CALLBACK, WRITE_CALLBACK, CLOSE_CALLBACK, VOID_CB,
     ARCHIVE_EOF, page_size,
-    entry_sourcepath, entry_clear,
-    read_disk_new, read_disk_open_w, read_next_header2, read_disk_descend,
-    read_free, write_header, write_data, write_finish_entry,
 )
 
 
+_zeros = bytes(bytearray(page_size))
+
+
+def _write_zeros(write_p, pos, end):
+    while pos < end:
+        n = min(end - pos, page_size)
+        ffi.write_data(write_p, _zeros, n)
+        pos += n
+    return pos
+
+
 @contextmanager
 def new_archive_read_disk(path):
-    archive_p = read_disk_new()
-    read_disk_open_w(archive_p, path)
+    archive_p = ffi.read_disk_new()
+    ffi.read_disk_open_w(archive_p, path)
     try:
         yield archive_p
     finally:
-        read_free(archive_p)
+        ffi.read_free(archive_p)
 
 
 class ArchiveWrite(object):
@@ -40,10 +48,16 @@ class ArchiveWrite(object):
         """
         write_p = self._pointer
         for entry in entries:
-            write_header(write_p, entry._entry_p)
-            for block in entry.get_blocks():
-                write_data(write_p, block, len(block))
-            write_finish_entry(write_p)
+            ffi.write_header(write_p, entry._entry_p)
+            written = 0
+            for offset, address, size in entry._iter_data_blocks():
+                # holes of sparse entries must be written out as zeros
+                written = _write_zeros(write_p, written, offset)
+                if size:
+                    ffi.write_data(write_p, address, size)
+                    written += size
+            _write_zeros(write_p, written, entry.size or 0)
+            ffi.write_finish_entry(write_p)
 
     def add_files(self, *paths):
         """Read the given paths from disk and add them to the archive.
@@ -59,24 +73,25 @@ class ArchiveWrite(object):
             for path in paths:
                 with new_archive_read_disk(path) as read_p:
                     while 1:
-                        r = read_next_header2(read_p, entry_p)
+                        r = ffi.read_next_header2(read_p, entry_p)
                         if r == ARCHIVE_EOF:
                             break
                         entry.pathname = entry.pathname.lstrip('/')
-                        read_disk_descend(read_p)
-                        write_header(write_p, entry_p)
+                        ffi.read_disk_descend(read_p)
+                        ffi.write_header(write_p, entry_p)
+                        sourcepath = ffi.entry_sourcepath(entry_p)
                         try:
-                            with open(entry_sourcepath(entry_p), 'rb') as f:
+                            with open(sourcepath, 'rb') as f:
                                 while 1:
                                     data = f.read(block_size)
                                     if not data:
                                         break
-                                    write_data(write_p, data, len(data))
+                                    ffi.write_data(write_p, data, len(data))
                         except IOError as e:
                             if e.errno != EISDIR:
                                 raise  # pragma: no cover
-                        write_finish_entry(write_p)
-                        entry_clear(entry_p)
+                        ffi.write_finish_entry(write_p)
+                        ffi.entry_clear(entry_p)
 
 
 @contextmanager
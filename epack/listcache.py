@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# encoding: utf-8
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+import os
+import errno
+try:
+    import cPickle as pickle  # py2
+except ImportError:
+    import pickle
+
+from epack.dirtree import DirTree
+
+
+# bump when the saved data change
+CACHE_VERSION = 1
+
+# the oldest listings are removed when the cache grow over this size
+DEFAULT_MAX_SIZE = 256 * 1024 * 1024
+
+# bytes at the start of the archive hashed to tell it is the same file
+HEADER_SIZE = 64 * 1024
+
+SUFFIX = '.listing'
+
+
+def cache_dir():
+    base = os.environ.get('XDG_CACHE_HOME') or \
+           os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'epack')
+
+
+def archive_identity(path):
+    """ What must not change for a saved listing to be valid: inode, size
+        and mtime of the file and an hash of its first bytes
+    """
+    import hashlib  # deferred, like tempfile below, for a faster startup
+    st = os.stat(path)
+    with open(path, 'rb') as f:
+        header = hashlib.sha1(f.read(HEADER_SIZE)).hexdigest()
+    mtime = getattr(st, 'st_mtime_ns', st.st_mtime)
+    return (st.st_dev, st.st_ino, st.st_size, mtime, header)
+
+
+class ListCache(object):
+    """ Archive listings (DirTree, with their seek index) saved on disk, one
+        file per archive path, so that opening the same archive again does
+        not need to read it all.
+
+        The files are touched when used, the least recently used ones are
+        deleted when the total size is over max_size. Any error (cache not
+        writable, corrupted file, ...) is just a cache miss.
+    """
+    def __init__(self, directory=None, max_size=DEFAULT_MAX_SIZE):
+        self.directory = directory or cache_dir()
+        self.max_size = max_size
+
+    def _file_for(self, path):
+        import hashlib
+        key = hashlib.sha1(os.path.abspath(path).encode('utf-8', 'replace'))
+        return os.path.join(self.directory, key.hexdigest() + SUFFIX)
+
+    def load(self, path):
+        """ The saved listing of path, None if there is not a valid one """
+        fname = self._file_for(path)
+        try:
+            identity = archive_identity(path)
+            with open(fname, 'rb') as f:
+                saved = pickle.load(f)
+            if saved['version'] != CACHE_VERSION or \
+               saved['identity'] != identity:
+                return None
+            tree = DirTree.load(saved['tree'])
+            tree.seek_index = saved['seek_index']
+            os.utime(fname, None)  # recently used
+        except (EnvironmentError, EOFError, KeyError, TypeError, ValueError,
+                pickle.UnpicklingError):
+            return None
+        return tree
+
+    def store(self, path, tree):
+        """ Save the (complete) listing of path, return True on success """
+        data = tree.dump()
+        if data is None:
+            return False
+        try:
+            saved = {
+                'version': CACHE_VERSION,
+                'identity': archive_identity(path),
+                'tree': data,
+                'seek_index': tree.seek_index,
+            }
+            self._makedirs()
+            import tempfile
+            # written aside and renamed, readers never see half a file
+            fd, tmp = tempfile.mkstemp(SUFFIX + '.tmp', dir=self.directory)
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    pickle.dump(saved, f, pickle.HIGHEST_PROTOCOL)
+                os.rename(tmp, self._file_for(path))
+            except:
+                os.unlink(tmp)
+                raise
+        except EnvironmentError as e:
+            print('Cannot save the listing cache: %s' % e)
+            return False
+        self.evict()
+        return True
+
+    def evict(self):
+        """ Delete the least recently used listings over max_size """
+        entries = []
+        try:
+            for name in os.listdir(self.directory):
+                if name.endswith(SUFFIX):
+                    fname = os.path.join(self.directory, name)
+                    st = os.stat(fname)
+                    entries.append((st.st_mtime, st.st_size, fname))
+        except EnvironmentError:
+            return
+        total = sum(size for mtime, size, fname in entries)
+        for mtime, size, fname in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                os.unlink(fname)
+            except EnvironmentError:
+                pass
+            total -= size
+
+    def _makedirs(self):
+        try:
+            os.makedirs(self.directory, 0o700)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
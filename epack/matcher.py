@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# encoding: utf-8
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+import re
+import fnmatch
+
+
+class PathMatcher(object):
+    """ Decide which archive entries must be extracted.
+
+        include and exclude are lists of shell-style patterns (or plain
+        paths, like the ones selected in the tree). As in tar, a pattern
+        matching a folder also matches everything inside it. An entry is
+        selected if it match at least one include pattern (or no include
+        pattern is given) and no exclude pattern.
+
+        Paths and patterns are compared as shown in the tree: without
+        empty or '.' components (ex: './d//f' is 'd/f').
+    """
+    def __init__(self, include=None, exclude=None):
+        self._include = _PatternSet(include) if include else None
+        self._exclude = _PatternSet(exclude) if exclude else None
+
+    def __call__(self, path):
+        if self._include is not None and not self._include.match(path):
+            return False
+        if self._exclude is not None and self._exclude.match(path):
+            return False
+        return True
+
+
+class _PatternSet(object):
+    def __init__(self, patterns):
+        self._literals = set()
+        self._regexes = []
+        for pattern in patterns:
+            pattern = _normpath(pattern)
+            if any(c in pattern for c in '*?['):
+                self._regexes.append(re.compile(fnmatch.translate(pattern)))
+            else:
+                self._literals.add(pattern)
+
+    def match(self, path):
+        # test the path and all its parent folders
+        path = _normpath(path)
+        while path:
+            if path in self._literals:
+                return True
+            for regex in self._regexes:
+                if regex.match(path):
+                    return True
+            path = path.rpartition('/')[0]
+        return False
+
+
+def _normpath(path):
+    return '/'.join(n for n in path.split('/') if n and n != '.')
@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+# encoding: utf-8
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+import os
+import time
+import multiprocessing
+
+import epack.libarchive as libarchive
+from epack.libarchive import ffi
+from epack.extractor import Extractor, apply_folders_metadata, makedirs, \
+                            entry_path
+from epack.writer import SYNC_END, SYNC_NONE
+
+
+# formats where the entries are independent and skipping one is a seek.
+# 7z is not here: libarchive cannot tell a solid 7z from a non-solid one
+# and on a solid archive every worker would decompress everything.
+PARALLEL_FORMATS = (
+    ffi.ARCHIVE_FORMAT_ZIP,
+    ffi.ARCHIVE_FORMAT_ISO9660,
+    ffi.ARCHIVE_FORMAT_TAR,
+    ffi.ARCHIVE_FORMAT_CPIO,
+)
+
+# how often (seconds) the workers counters are collected
+POLL_INTERVAL = 0.05
+
+
+def is_parallelizable(archive):
+    """ True if the archive (with at least one header read) can be split
+        between many readers
+    """
+    base = archive.format & ffi.ARCHIVE_FORMAT_BASE_MASK
+    return base in PARALLEL_FORMATS and \
+           all(f == ffi.ARCHIVE_FILTER_NONE for f in archive.filters)
+
+
+def plan_shards(sizes, jobs):
+    """ Split the (index, size) couples in jobs sets of indices with about
+        the same total size (largest first, to the least loaded shard)
+    """
+    shards = [set() for i in range(jobs)]
+    loads = [0] * jobs
+    for index, size in sorted(sizes, key=lambda s: s[1], reverse=True):
+        n = loads.index(min(loads))
+        shards[n].add(index)
+        loads[n] += size + 1  # +1 so that empty files are balanced too
+    return [s for s in shards if s]
+
+
+class _SharedProgress(object):
+    """ The Progress seen by a worker process, counters live in shared
+        memory so that the parent can sum them up
+    """
+    __slots__ = ('_counters', '_slot', 'current', 'input_done')
+
+    def __init__(self, counters, slot):
+        self._counters = counters
+        self._slot = slot * 2
+        self.current = ''
+        self.input_done = 0
+
+    @property
+    def bytes_done(self):
+        return self._counters[self._slot]
+
+    @bytes_done.setter
+    def bytes_done(self, value):
+        self._counters[self._slot] = value
+
+    @property
+    def entries_done(self):
+        return self._counters[self._slot + 1]
+
+    @entries_done.setter
+    def entries_done(self, value):
+        self._counters[self._slot + 1] = value
+
+
+def _worker(archive_file, destination, indices, counters, slot, options,
+            errors):
+    progress = _SharedProgress(counters, slot)
+    try:
+        extractor = Extractor(progress, **options)
+        extractor.extract(archive_file, destination, indices=indices,
+                          skip_dirs=True)
+    except Exception as e:
+        errors.put(str(e))
+
+
+class ParallelExtractor(object):
+    """ Extract seekable archives (zip, iso9660, uncompressed tar/cpio)
+        using many processes, each with its own reader that only extract
+        its shard of the entries, skipping (seeking over) the others.
+
+        Other formats, or jobs < 2, fall back to a plain Extractor.
+        Same interface of Extractor.
+    """
+    def __init__(self, jobs, progress=None, stoprequest=None, **options):
+        self.jobs = jobs if jobs > 0 else multiprocessing.cpu_count()
+        # the workers do not sync at the end, the whole extraction does
+        self.options = dict(options)
+        if options.get('sync') == SYNC_END:
+            self.options['sync'] = SYNC_NONE
+        # nor keep a journal, their entries are not in order
+        self.options['journal'] = False
+        self.extractor = Extractor(progress, stoprequest, **options)
+        self.progress = self.extractor.progress
+        self.stoprequest = self.extractor.stoprequest
+
+    @property
+    def total_size(self):
+        return self.extractor.total_size
+
+    @property
+    def stats(self):
+        return self.extractor.stats
+
+    def extract(self, archive_file, destination, listing=None, matcher=None):
+        if self.jobs < 2 or not self._check_archive(archive_file):
+            return self.extractor.extract(archive_file, destination,
+                                          listing, matcher)
+
+        # read all the headers (cheap, the data is seeked over)
+        sizes, folders, parents = [], [], set()
+        links = set()  # hard links, made once the workers are done
+        failed = self.extractor.failed
+        with libarchive.mmap_reader(archive_file) as archive:
+            for index, entry in enumerate(archive):
+                pathname = entry.pathname
+                if listing is not None:
+                    listing.add(pathname, entry.size, entry.isdir,
+                                entry.mtime, entry.filetype | entry.perm,
+                                index, archive.header_position)
+                    self.extractor.total_size += entry.size or 0
+                if matcher is not None and not matcher(pathname):
+                    continue
+                path = entry_path(destination, pathname)
+                if path is None:
+                    failed.append('%s: path with ..' % pathname)
+                    continue
+                if entry.isdir:
+                    owner = (entry.uid, entry.gid) \
+                            if self.extractor.same_owner else None
+                    folders.append((path, entry.perm, entry.mtime, owner))
+                elif entry.hardlink is not None:
+                    # its target may be in another shard
+                    links.add(index)
+                else:
+                    sizes.append((index, entry.size or 0))
+                    parents.add(os.path.dirname(path))
+                if self.stoprequest.is_set():
+                    raise RuntimeError('stopped')
+
+        # folders are created here, before the workers need them
+        for path in parents:
+            makedirs(path)
+        for path, perm, mtime, owner in folders:
+            makedirs(path)
+
+        shards = plan_shards(sizes, self.jobs)
+        self.progress.reset(total_size=sum(size for i, size in sizes),
+                            total_entries=len(sizes) + len(links))
+        self._run_workers(archive_file, destination, shards)
+        if links:
+            Extractor(self.progress, self.stoprequest, **self.options) \
+                .extract(archive_file, destination, indices=links,
+                         skip_dirs=True)
+
+        # and their metadata applied at the end, deepest first
+        apply_folders_metadata(folders)
+        self.extractor.writer.sync_all(destination)
+        if failed:
+            raise Exception('%d entries not extracted, %s' %
+                            (len(failed), failed[0]))
+
+    def _check_archive(self, archive_file):
+        with libarchive.mmap_reader(archive_file) as archive:
+            for entry in archive:
+                return is_parallelizable(archive)
+        return False
+
+    def _run_workers(self, archive_file, destination, shards):
+        try:
+            # never fork a process that run threads (and maybe a UI)
+            ctx = multiprocessing.get_context('spawn')
+        except AttributeError:  # py2
+            ctx = multiprocessing
+        counters = ctx.Array('q', len(shards) * 2, lock=False)
+        errors = ctx.Queue()
+        workers = []
+        for slot, indices in enumerate(shards):
+            p = ctx.Process(target=_worker,
+                            args=(archive_file, destination, indices,
+                                  counters, slot, self.options, errors))
+            p.daemon = True
+            p.start()
+            workers.append(p)
+
+        progress = self.progress
+        try:
+            while any(p.is_alive() for p in workers):
+                if self.stoprequest.is_set():
+                    raise RuntimeError('stopped')
+                time.sleep(POLL_INTERVAL)
+                progress.bytes_done = sum(counters[0::2])
+                progress.entries_done = sum(counters[1::2])
+        finally:
+            for p in workers:
+                if p.is_alive():
+                    p.terminate()
+                p.join()
+
+        progress.bytes_done = sum(counters[0::2])
+        progress.entries_done = sum(counters[1::2])
+        if not errors.empty():
+            raise Exception(errors.get())
+        for p in workers:
+            if p.exitcode != 0:
+                raise Exception('extraction worker died (exit code %s)' %
+                                p.exitcode)
@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# encoding: utf-8
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+import threading
+try:
+    from queue import Queue # py3
+except:
+    from Queue import Queue # py2
+
+from epack.writer import BUFFER_SIZE
+
+
+# the decoded data waiting to be written is at most BUFFERS * BUFFER_SIZE
+BUFFERS = 8
+
+# the operations (open, write, close...) are sent to the writing thread in
+# batches, one per buffer filled or of at most BATCH_SIZE operations
+BATCH_SIZE = 256
+
+# batches waiting in the queue (the buffers already limit the data)
+QUEUE_SIZE = 64
+
+
+class PipelinedOutput(object):
+    """ Same interface of DiskOutput, that does the real work in a thread:
+        while it writes a file the caller is already decoding the next data.
+
+        The data is copied in a pool of reusable buffers (the libarchive
+        blocks are only valid until the next read), many small files in the
+        same buffer, and sent to the writing thread with the operations on
+        it, in a bounded queue: when the disk is slower the decoding waits
+        for a free buffer, the memory used does not grow. libarchive and
+        os.write both release the GIL, so the two really overlap.
+
+        An error of the writing thread is raised in the caller at the next
+        batch sent.
+    """
+    def __init__(self, output, buffers=BUFFERS, buffer_size=BUFFER_SIZE):
+        self.output = output
+        self._free = Queue()
+        for i in range(buffers):
+            self._free.put(bytearray(buffer_size))
+        self._queue = Queue(QUEUE_SIZE)
+        self._ops = []       # the operations of the next batch...
+        self._buffer = None  # ...with the data of its writes...
+        self._used = 0       # ...filled up to here
+        self._error = None
+        self._aborted = False  # the queued data is not to be written
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def entry(self, *args):
+        self._add('entry', args)
+
+    def folder(self, *args):
+        self._add('folder', args)
+
+    def symlink(self, *args):
+        self._add('symlink', args)
+
+    def hardlink(self, *args):
+        self._add('hardlink', args)
+
+    def metadata(self, *args):
+        self._add('metadata', args)
+
+    def open(self, *args):
+        self._add('open', args)
+
+    def write(self, offset, data):
+        size = len(data)
+        pos = 0
+        while pos < size:
+            buf = self._buffer
+            if buf is None:
+                buf = self._buffer = self._free.get()
+                self._used = 0
+            used = self._used
+            count = min(size - pos, len(buf) - used)
+            if not count:  # full
+                self._send()
+                continue
+            buf[used:used + count] = data[pos:pos + count]
+            # (offset, position in the buffer, size) of the data, the
+            # previous write is extended when it continues it
+            ops = self._ops
+            if ops and ops[-1][0] == 'write' and \
+               ops[-1][1][0] + ops[-1][1][2] == offset + pos and \
+               ops[-1][1][1] + ops[-1][1][2] == used:
+                ops[-1][1][2] += count
+            else:
+                self._add('write', [offset + pos, used, count])
+            self._used = used + count
+            pos += count
+
+    def close(self, size):
+        self._add('close', (size,))
+
+    def finish(self):
+        """ Wait for all the writing, raise its error if any """
+        self._add('finish', ())
+        self._send()
+        self._stop()
+        if self._error is not None:
+            self.output.abort()  # the thread is over, safe here
+            raise self._error
+
+    def abort(self):
+        """ Stop the writing, the open file is closed as it is """
+        self._ops = []
+        self._buffer = None
+        self._aborted = True
+        self._queue.put(([('abort', ())], None))
+        self._stop()
+
+    def _stop(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _add(self, name, args):
+        self._ops.append((name, args))
+        if len(self._ops) >= BATCH_SIZE:
+            self._send()
+
+    def _send(self):
+        if self._error is not None:
+            raise self._error
+        if self._ops or self._buffer is not None:
+            self._queue.put((self._ops, self._buffer))
+            self._ops = []
+            self._buffer = None
+
+    def _run(self):
+        output = self.output
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            ops, buf = item
+            view = memoryview(buf) if buf is not None else None
+            for name, args in ops:
+                # after an error (or a stop) only wait for the abort
+                if (self._error is not None or self._aborted) and \
+                   name != 'abort':
+                    continue
+                try:
+                    if name == 'write':
+                        offset, pos, count = args
+                        output.write(offset, view[pos:pos + count])
+                    else:
+                        getattr(output, name)(*args)
+                except Exception as e:
+                    self._error = e
+            if buf is not None:
+                view = None
+                self._free.put(buf)
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# encoding: utf-8
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+import threading
+
+
+# bytes read from the start of the file
+PROBE_SIZE = 4096
+
+# (offset, signature, name, mime-type) of the compression filters...
+FILTERS = (
+    (0, b'\x1f\x8b', 'gzip', 'application/gzip'),
+    (0, b'BZh', 'bzip2', 'application/x-bzip2'),
+    (0, b'\xfd7zXZ\x00', 'xz', 'application/x-xz'),
+    (0, b'\x28\xb5\x2f\xfd', 'zstd', 'application/zstd'),
+    (0, b'\x04\x22\x4d\x18', 'lz4', 'application/x-lz4'),
+    (0, b'LZIP', 'lzip', 'application/x-lzip'),
+    (0, b'\x1f\x9d', 'compress', 'application/x-compress'),
+)
+
+# ...and of the archive formats
+FORMATS = (
+    (0, b'PK\x03\x04', 'zip', 'application/zip'),
+    (0, b'PK\x05\x06', 'zip', 'application/zip'),  # empty
+    (0, b'Rar!\x1a\x07', 'rar', 'application/x-rar'),
+    (0, b'7z\xbc\xaf\x27\x1c', '7zip', 'application/x-7z-compressed'),
+    (257, b'ustar', 'tar', 'application/x-tar'),
+    (0, b'070707', 'cpio', 'application/x-cpio'),
+    (0, b'070701', 'cpio', 'application/x-cpio'),
+    (0, b'070702', 'cpio', 'application/x-cpio'),
+    (0, b'\xc7\x71', 'cpio', 'application/x-cpio'),  # binary, little endian
+    (0, b'!<arch>\n', 'ar', 'application/x-archive'),
+    (0, b'\xed\xab\xee\xdb', 'rpm', 'application/x-rpm'),
+    (0, b'xar!', 'xar', 'application/x-xar'),
+    (0, b'MSCF', 'cab', 'application/vnd.ms-cab-compressed'),
+    (2, b'-lh', 'lha', 'application/x-lha'),
+)
+
+# the iso9660 volume descriptor is far from the start, only looked for
+# when nothing else matched
+ISO9660 = (32769, b'CD001', 'iso9660', 'application/x-iso9660-image')
+
+
+class Probe(object):
+    """ What the first bytes of a file tell about it: the compression
+        filter and the archive format (by name, None if unknown; the format
+        of a compressed archive is not known) and the mime-type of the
+        outermost of the two.
+    """
+    __slots__ = ('filter', 'format', 'mime')
+
+    def __init__(self, filter=None, format=None, mime=None):
+        self.filter = filter
+        self.format = format
+        self.mime = mime
+
+    @property
+    def known(self):
+        return self.mime is not None
+
+    def __repr__(self):
+        return 'Probe(filter=%r, format=%r, mime=%r)' % \
+               (self.filter, self.format, self.mime)
+
+
+def _match(table, header):
+    for offset, signature, name, mime in table:
+        if header.startswith(signature, offset):
+            return name, mime
+    return None, None
+
+
+def _is_tar(header):
+    """ old (v7) tar headers have no magic, check the header checksum """
+    if len(header) < 512 or not header[148:156].strip(b' \0'):
+        return False
+    try:
+        stored = int(header[148:156].strip(b' \0'), 8)
+    except ValueError:
+        return False
+    data = bytearray(header[:512])
+    data[148:156] = b' ' * 8
+    return sum(data) == stored
+
+
+def probe(path):
+    """ Read the start of path once and match it against the signatures
+        tables, raise EnvironmentError if the file cannot be read
+    """
+    with open(path, 'rb') as f:
+        header = f.read(PROBE_SIZE)
+        name, mime = _match(FILTERS, header)
+        if name is not None:
+            return Probe(filter=name, mime=mime)
+        name, mime = _match(FORMATS, header)
+        if name is None and _is_tar(header):
+            name, mime = 'tar', 'application/x-tar'
+        if name is None:
+            offset, signature = ISO9660[:2]
+            f.seek(offset)
+            if f.read(len(signature)) == signature:
+                name, mime = ISO9660[2:]
+        return Probe(format=name, mime=mime)
+
+
+_magic = None
+_magic_lock = threading.Lock()
+
+
+def magic_mime_type(path):
+    """ The mime-type of path according to libmagic. The magic database is
+        loaded once, on first use, and shared by all the threads.
+    """
+    global _magic
+    import magic
+    with _magic_lock:  # a magic handle is not thread safe
+        if _magic is None:
+            m = magic.open(magic.MAGIC_MIME_TYPE)
+            m.load()
+            _magic = m
+        return _magic.file(path)
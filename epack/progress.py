@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# encoding: utf-8
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+import time
+
+
+# default interval (in seconds) between two samples of the UI side
+DEFAULT_INTERVAL = 0.1
+
+# weight of the last sample in the smoothed rates
+SMOOTHING = 0.3
+
+
+class Progress(object):
+    """ Progress counters shared between a worker and the UI.
+
+        The worker is the only writer: it just bumps bytes_done and
+        entries_done and sets current, plain attribute stores that need no
+        locking. The UI samples the counters at its own pace with sample(),
+        that also computes the transfer rates and the ETA.
+
+        When the uncompressed total_size is not known in advance the
+        position in the (compressed) input, input_done of input_size, is
+        used for the fraction and the ETA.
+    """
+    __slots__ = ('total_size', 'total_entries', 'bytes_done', 'entries_done',
+                 'input_size', 'input_done', 'current',
+                 'bytes_rate', 'entries_rate', 'input_rate', 'start_time',
+                 '_last_time', '_last_bytes', '_last_entries', '_last_input')
+
+    def __init__(self, total_size=0, total_entries=0, input_size=0):
+        self.reset(total_size, total_entries, input_size)
+
+    def reset(self, total_size=0, total_entries=0, input_size=0):
+        self.total_size = total_size
+        self.total_entries = total_entries
+        self.input_size = input_size
+        self.bytes_done = 0
+        self.entries_done = 0
+        self.input_done = 0
+        self.current = ''
+        self.bytes_rate = 0.0
+        self.entries_rate = 0.0
+        self.input_rate = 0.0
+        self.start_time = self._last_time = time.time()
+        self._last_bytes = 0
+        self._last_entries = 0
+        self._last_input = 0
+
+    def sample(self):
+        """ Update the rates, return True if something changed since the
+            previous sample.
+        """
+        now = time.time()
+        elapsed = now - self._last_time
+        bytes_done, entries_done = self.bytes_done, self.entries_done
+        input_done = self.input_done
+        changed = bytes_done != self._last_bytes or \
+                  entries_done != self._last_entries or \
+                  input_done != self._last_input
+        if elapsed > 0:
+            brate = (bytes_done - self._last_bytes) / elapsed
+            erate = (entries_done - self._last_entries) / elapsed
+            irate = (input_done - self._last_input) / elapsed
+            if self._last_bytes or self._last_entries or self._last_input:
+                brate = SMOOTHING * brate + (1 - SMOOTHING) * self.bytes_rate
+                erate = SMOOTHING * erate + (1 - SMOOTHING) * self.entries_rate
+                irate = SMOOTHING * irate + (1 - SMOOTHING) * self.input_rate
+            self.bytes_rate, self.entries_rate = brate, erate
+            self.input_rate = irate
+        self._last_time = now
+        self._last_bytes, self._last_entries = bytes_done, entries_done
+        self._last_input = input_done
+        return changed
+
+    @property
+    def fraction(self):
+        """ Completed fraction (0.0 - 1.0) """
+        if self.total_size > 0:
+            return min(1.0, float(self.bytes_done) / self.total_size)
+        if self.input_size > 0:
+            return min(1.0, float(self.input_done) / self.input_size)
+        if self.total_entries > 0:
+            return min(1.0, float(self.entries_done) / self.total_entries)
+        return 0.0
+
+    @property
+    def eta(self):
+        """ Estimated seconds to completion, None if unknown """
+        if self.total_size > 0:
+            if self.bytes_rate > 0:
+                return max(0, self.total_size - self.bytes_done) / \
+                       self.bytes_rate
+        elif self.input_size > 0 and self.input_rate > 0:
+            return max(0, self.input_size - self.input_done) / self.input_rate
+        return None
+
+    @property
+    def elapsed(self):
+        return time.time() - self.start_time
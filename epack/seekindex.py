@@ -0,0 +1,480 @@
+#!/usr/bin/env python
+# encoding: utf-8
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+""" Random access into compressed archives.
+
+    A seek index maps offsets in the uncompressed data to points of the
+    compressed file where decoding can start. For gzip the points are
+    taken (zran style) while the whole file is read the first time: the
+    position of a deflate block boundary, its bit offset and the last 32K
+    of output as the dictionary. For xz the index of the blocks, stored
+    at the end of the file, is used as is.
+
+    IndexedStream then reads the uncompressed data from any offset,
+    starting at the nearest point.
+"""
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+import os
+import zlib
+import struct
+import ctypes
+from ctypes import byref, c_char_p, c_int, c_uint, c_ulong, \
+    c_void_p, sizeof
+try:
+    import lzma
+except ImportError:  # py2
+    lzma = None
+
+
+# ideal distance (uncompressed bytes) between two gzip points, bigger
+# for big files to keep the number of windows reasonable
+MIN_SPAN = 1024 * 1024
+MAX_POINTS = 512
+
+CHUNK = 256 * 1024  # compressed bytes read at once
+WINSIZE = 32768     # deflate window
+
+
+### zlib binding ##############################################################
+
+Z_OK = 0
+Z_STREAM_END = 1
+Z_NEED_DICT = 2
+Z_BUF_ERROR = -5
+Z_NO_FLUSH = 0
+Z_BLOCK = 5
+
+
+class _ZStream(ctypes.Structure):
+    _fields_ = [
+        ('next_in', c_void_p), ('avail_in', c_uint), ('total_in', c_ulong),
+        ('next_out', c_void_p), ('avail_out', c_uint), ('total_out', c_ulong),
+        ('msg', c_char_p), ('state', c_void_p),
+        ('zalloc', c_void_p), ('zfree', c_void_p), ('opaque', c_void_p),
+        ('data_type', c_int), ('adler', c_ulong), ('reserved', c_ulong),
+    ]
+
+
+def _load_libz():
+    try:
+        return ctypes.CDLL('libz.so.1')
+    except OSError:
+        from ctypes.util import find_library  # slow, spawns processes
+        return ctypes.CDLL(find_library('z') or 'libz.so')
+
+
+def _zfunc(name, argtypes):
+    f = getattr(_libz, name)
+    f.argtypes = argtypes
+    f.restype = c_int
+    return f
+
+try:
+    _libz = _load_libz()
+    _libz.zlibVersion.restype = c_char_p
+    _zlib_version = _libz.zlibVersion()
+    _z_p = ctypes.POINTER(_ZStream)
+    _inflateInit2_ = _zfunc('inflateInit2_', [_z_p, c_int, c_char_p, c_int])
+    _inflate = _zfunc('inflate', [_z_p, c_int])
+    _inflateEnd = _zfunc('inflateEnd', [_z_p])
+    _inflateReset2 = _zfunc('inflateReset2', [_z_p, c_int])
+    _inflatePrime = _zfunc('inflatePrime', [_z_p, c_int, c_int])
+    _inflateSetDictionary = _zfunc('inflateSetDictionary',
+                                   [_z_p, c_void_p, c_uint])
+except (OSError, AttributeError):
+    _libz = None
+
+
+class _Inflater(object):
+    """ A zlib inflate stream reading from a file """
+
+    def __init__(self, f, wbits):
+        self.f = f
+        self.raw = wbits < 0
+        self.strm = _ZStream()
+        self._in = ctypes.create_string_buffer(CHUNK)
+        self._in_addr = ctypes.addressof(self._in)
+        ret = _inflateInit2_(byref(self.strm), wbits, _zlib_version,
+                             sizeof(_ZStream))
+        if ret != Z_OK:
+            raise IOError('inflateInit failed (%d)' % ret)
+
+    def close(self):
+        _inflateEnd(byref(self.strm))
+
+    @property
+    def in_pos(self):
+        """ file position of the next compressed byte to decode """
+        return self.f.tell() - self.strm.avail_in
+
+    def fill(self):
+        """ read more input if needed, False at the end of the file """
+        if self.strm.avail_in == 0:
+            n = self.f.readinto(self._in)
+            if not n:
+                return False
+            self.strm.next_in = self._in_addr
+            self.strm.avail_in = n
+        return True
+
+    def inflate(self, out_addr, out_size, flush=Z_NO_FLUSH):
+        self.strm.next_out = out_addr
+        self.strm.avail_out = out_size
+        ret = _inflate(byref(self.strm), flush)
+        if ret not in (Z_OK, Z_STREAM_END, Z_BUF_ERROR):
+            msg = self.strm.msg
+            raise IOError('inflate failed: %s' %
+                          (msg.decode('ascii', 'replace') if msg else ret))
+        return ret, out_size - self.strm.avail_out
+
+    def next_member(self):
+        """ continue with the next gzip member (concatenated gzip files),
+            False if there is none. In raw mode the 8 bytes trailer of the
+            previous member are skipped.
+        """
+        pos = self.in_pos
+        if self.raw:
+            pos += 8
+        self.f.seek(pos)
+        self.strm.avail_in = 0
+        if self.f.read(2) != b'\x1f\x8b':
+            return False  # the end, or trailing garbage
+        self.f.seek(pos)
+        self.fill()
+        self.raw = False
+        return _inflateReset2(byref(self.strm), 31) == Z_OK
+
+
+### gzip ######################################################################
+
+class GzipIndex(object):
+    """ Seek points of a gzip file: (out, in, bits, window) tuples, where
+        out is the uncompressed offset, in the compressed one, bits the
+        bits of the byte before in still to decode and window the zlib
+        compressed dictionary.
+    """
+    kind = 'gzip'
+
+    def __init__(self, span=MIN_SPAN, points=None):
+        self.span = span
+        self.points = points or []
+
+    @staticmethod
+    def span_for(path):
+        return max(MIN_SPAN, os.path.getsize(path) * 3 // MAX_POINTS)
+
+    def build(self, f):
+        """ Decompress all the gzip file f, yielding the data, while
+            taking the seek points
+        """
+        del self.points[:]
+        # output buffer, its first WINSIZE bytes keep the end of the
+        # previous round so that the last 32K are always contiguous
+        out = ctypes.create_string_buffer(CHUNK)
+        out_addr = ctypes.addressof(out)
+        inf = _Inflater(f, 47)  # gzip or zlib header
+        try:
+            totout = 0
+            next_point = 0  # look for a block boundary after this offset
+            have = 0  # bytes used in out
+            while inf.fill():
+                while inf.strm.avail_in:
+                    if have == CHUNK:
+                        ctypes.memmove(out_addr, out_addr + CHUNK - WINSIZE,
+                                       WINSIZE)
+                        have = WINSIZE
+                    # stop at the deflate blocks ends only when a point
+                    # is needed
+                    flush = Z_BLOCK if totout >= next_point else Z_NO_FLUSH
+                    ret, n = inf.inflate(out_addr + have, CHUNK - have, flush)
+                    if n:
+                        yield ctypes.string_at(out_addr + have, n)
+                        have += n
+                        totout += n
+                    if ret == Z_STREAM_END:
+                        if not inf.next_member():
+                            return
+                        continue
+                    # at the end of a deflate block (not the last one)
+                    data_type = inf.strm.data_type
+                    if flush == Z_BLOCK and data_type & 128 and \
+                       not data_type & 64:
+                        window = ctypes.string_at(
+                            out_addr + max(0, have - WINSIZE),
+                            min(have, WINSIZE))
+                        self.points.append((totout, inf.in_pos,
+                                            data_type & 7,
+                                            zlib.compress(window, 1)))
+                        next_point = totout + self.span
+                    if n == 0 and ret == Z_BUF_ERROR:
+                        break  # need more input
+        finally:
+            inf.close()
+
+    def decompress(self, f, offset):
+        """ Yield the uncompressed data from offset on """
+        point = self._point_before(offset)
+        if point is None:
+            # no point before offset, start from the gzip header
+            f.seek(0)
+            inf = _Inflater(f, 47)
+            skip = offset
+        else:
+            out, in_pos, bits, dictionary = point
+            inf = _Inflater(f, -15)  # raw deflate
+            if bits:
+                f.seek(in_pos - 1)
+                value = bytearray(f.read(1))[0]
+                _inflatePrime(byref(inf.strm), bits, value >> (8 - bits))
+            else:
+                f.seek(in_pos)
+            dictionary = zlib.decompress(dictionary)
+            if dictionary:
+                _inflateSetDictionary(byref(inf.strm), dictionary,
+                                      len(dictionary))
+            skip = offset - out
+        try:
+            buf = ctypes.create_string_buffer(CHUNK)
+            buf_addr = ctypes.addressof(buf)
+            while inf.fill():
+                ret, n = inf.inflate(buf_addr, CHUNK)
+                if n > skip:
+                    yield ctypes.string_at(buf_addr + skip, n - skip)
+                    skip = 0
+                elif n:
+                    skip -= n
+                if ret == Z_STREAM_END and not inf.next_member():
+                    return
+        finally:
+            inf.close()
+
+    def _point_before(self, offset):
+        point = None
+        for p in self.points:
+            if p[0] > offset:
+                break
+            point = p
+        return point
+
+
+### xz ########################################################################
+
+_XZ_MAGIC = b'\xfd7zXZ\x00'
+_XZ_CHECK_SIZES = {0: 0, 1: 4, 4: 8, 10: 32}
+_FILTER_LZMA2 = 0x21
+
+
+def _varint(data, pos):
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        shift += 7
+        if not byte & 0x80:
+            return value, pos
+
+
+class XzIndex(object):
+    """ Seek points of a multi-block xz file: (out, in) of every block,
+        taken from the index at the end of the file
+    """
+    kind = 'xz'
+
+    def __init__(self, span=0, points=None, check_size=4):
+        self.span = span
+        self.points = points or []
+        self.check_size = check_size
+
+    @classmethod
+    def from_file(cls, f):
+        """ Read the blocks index, None if the file can't be indexed (not
+            a single stream xz with LZMA2 blocks, or a single block)
+        """
+        f.seek(0, os.SEEK_END)
+        end = f.tell()
+        f.seek(0)
+        header = bytearray(f.read(12))
+        if lzma is None or len(header) < 12 or \
+           bytes(header[:6]) != _XZ_MAGIC:
+            return None
+        check_size = _XZ_CHECK_SIZES.get(header[7] & 0x0f)
+
+        # skip the stream padding and read the footer
+        while end >= 24:
+            f.seek(end - 4)
+            if f.read(4) != b'\0\0\0\0':
+                break
+            end -= 4
+        f.seek(end - 12)
+        footer = bytearray(f.read(12))
+        if check_size is None or bytes(footer[10:12]) != b'YZ':
+            return None
+        backward_size = (struct.unpack('<I', bytes(footer[4:8]))[0] + 1) * 4
+        index_start = end - 12 - backward_size
+        f.seek(index_start)
+        index = bytearray(f.read(backward_size))
+
+        try:
+            if index[0] != 0:
+                return None
+            count, pos = _varint(index, 1)
+            points = []
+            out, in_pos = 0, 12
+            for i in range(count):
+                unpadded, pos = _varint(index, pos)
+                size, pos = _varint(index, pos)
+                points.append((out, in_pos))
+                out += size
+                in_pos += (unpadded + 3) // 4 * 4
+        except IndexError:
+            return None
+        # a second stream, or garbage: not supported
+        if in_pos != index_start or len(points) < 2:
+            return None
+        return cls(out // len(points), points, check_size)
+
+    def decompress(self, f, offset):
+        """ Yield the uncompressed data from offset on """
+        i = 0
+        while i + 1 < len(self.points) and self.points[i + 1][0] <= offset:
+            i += 1
+        skip = offset - self.points[i][0]
+        for out, in_pos in self.points[i:]:
+            for data in self._decompress_block(f, in_pos):
+                if len(data) > skip:
+                    yield data[skip:] if skip else data
+                    skip = 0
+                else:
+                    skip -= len(data)
+
+    def _decompress_block(self, f, in_pos):
+        f.seek(in_pos)
+        size = bytearray(f.read(1))[0]
+        header = bytearray(f.read((size + 1) * 4 - 1))
+        flags = header[0]
+        pos = 1
+        if flags & 0x40:
+            compressed, pos = _varint(header, pos)
+        if flags & 0x80:
+            uncompressed, pos = _varint(header, pos)
+        filter_id, pos = _varint(header, pos)
+        props_size, pos = _varint(header, pos)
+        if flags & 3 or filter_id != _FILTER_LZMA2 or props_size != 1:
+            raise IOError('xz block filters not supported')
+        bits = header[pos]
+        dict_size = 0xffffffff if bits == 40 else \
+                    (2 | (bits & 1)) << (bits // 2 + 11)
+
+        dec = lzma.LZMADecompressor(lzma.FORMAT_RAW, filters=[
+            {'id': lzma.FILTER_LZMA2, 'dict_size': dict_size}])
+        while not dec.eof:
+            data = f.read(CHUNK)
+            if not data:
+                raise IOError('truncated xz block')
+            yield dec.decompress(data)
+
+
+### the stream ################################################################
+
+def load_index(path):
+    """ The seek index of the file at path that can be had without reading
+        it all (xz), None if there is none
+    """
+    with open(path, 'rb') as f:
+        return XzIndex.from_file(f)
+
+
+def is_gzip(path):
+    if _libz is None:
+        return False
+    with open(path, 'rb') as f:
+        return f.read(2) == b'\x1f\x8b'
+
+
+class IndexedStream(object):
+    """ A read-only seekable file over the uncompressed data of path.
+
+        With an empty GzipIndex the file is read from the start and the
+        index is built while reading. Seeking backward, or far forward,
+        restarts the decoding from the nearest point.
+    """
+
+    def __init__(self, path, index):
+        self.index = index
+        self._f = open(path, 'rb')
+        self._pos = 0
+        self._data = b''  # decoded data, starting at _pos
+        self._building = isinstance(index, GzipIndex) and not index.points
+        if self._building:
+            self._decoder = index.build(self._f)
+        else:
+            self._decoder = index.decompress(self._f, 0)
+
+    def close(self):
+        self._decoder.close()
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def tell(self):
+        return self._pos
+
+    def seekable(self):
+        return True
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self._pos
+        elif whence != os.SEEK_SET:
+            raise IOError('IndexedStream can only seek from the start')
+        if self._building and offset < self._pos:
+            raise IOError('cannot seek backward while building the index')
+        if not self._building and (offset < self._pos or
+                                   offset - self._pos > self.index.span):
+            self._decoder.close()
+            self._decoder = self.index.decompress(self._f, offset)
+            self._pos, self._data = offset, b''
+        else:
+            while self._pos < offset:
+                if not self.read(min(offset - self._pos, CHUNK)):
+                    break  # end of data
+        return self._pos
+
+    def readinto(self, buf):
+        data = self.read(len(buf))
+        ctypes.memmove(buf, data, len(data))
+        return len(data)
+
+    def read(self, size=-1):
+        while not self._data:
+            try:
+                self._data = next(self._decoder)
+            except StopIteration:
+                return b''
+        if size < 0 or size >= len(self._data):
+            data, self._data = self._data, b''
+        else:
+            data, self._data = self._data[:size], self._data[size:]
+        self._pos += len(data)
+        return data
@@ -19,13 +19,14 @@ from __future__ import absolute_import, print_function, unicode_literals
 
 import os
 from distutils.spawn import find_executable
-from efl.ecore import Exe
 
 
 def xdg_open(url_or_file):
+    from efl.ecore import Exe
     Exe('xdg-open "%s"' % url_or_file)
 
 def open_in_terminal(folder):
+    from efl.ecore import Exe
     term = None
 
     if os.getenv('TERM') is not None:
@@ -48,6 +49,22 @@ def open_in_terminal(folder):
 
     return term
 
+def format_size(size):
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if abs(size) < 1024:
+            break
+        size /= 1024.0
+    else:
+        unit = 'TiB'
+    return '%.1f %s' % (size, unit) if unit != 'B' else '%d B' % size
+
+def format_time(seconds):
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return '%d:%02d:%02d' % (seconds // 3600, seconds // 60 % 60,
+                                 seconds % 60)
+    return '%d:%02d' % (seconds // 60, seconds % 60)
+
 
 GITHUB = 'https://github.com/wfx/epack'
 
@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+# encoding: utf-8
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+import os
+import errno
+
+
+# durability of the extracted files
+SYNC_NONE = 'none'  # left to the kernel
+SYNC_FILE = 'file'  # fsync each file before closing it
+SYNC_END = 'end'    # a single syncfs of the destination at the end
+SYNC_POLICIES = (SYNC_NONE, SYNC_FILE, SYNC_END)
+
+# the small data blocks are gathered in a buffer of this size, bigger
+# blocks are written as they are
+BUFFER_SIZE = 1024 * 1024
+
+# files smaller than this are not preallocated, they are written in one go
+# anyway and the extra syscall would cost more than it saves
+PREALLOCATE_MIN = 1024 * 1024
+
+# ioctl(dest_fd, FICLONE, src_fd) make dest share the data blocks of src
+# (copy on write: btrfs, xfs, ...), linux only
+FICLONE = 0x40049409
+
+# errors of FICLONE where the filesystem (or the os) cannot clone
+REFLINK_UNSUPPORTED = (errno.EOPNOTSUPP, getattr(errno, 'ENOTSUP', 0),
+                       errno.EXDEV, errno.EINVAL, errno.ENOTTY, errno.ENOSYS)
+
+# never write through a symlink
+_OPEN_FLAGS = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | \
+              getattr(os, 'O_NOFOLLOW', 0) | getattr(os, 'O_CLOEXEC', 0) | \
+              getattr(os, 'O_BINARY', 0)
+
+
+def syncfs(path):
+    """ Flush the filesystem where path reside: syncfs(2) on linux, a
+        global sync where it is not available
+    """
+    import ctypes  # deferred, only needed at the end of an extraction
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        try:
+            libc = ctypes.CDLL(None, use_errno=True)
+            if libc.syncfs(fd) == 0:
+                return
+        except AttributeError:
+            pass
+        if hasattr(os, 'sync'):
+            os.sync()
+        else:
+            os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class Writer(object):
+    """ Write the data of the extracted files, one file at a time:
+        create(), write() the (offset, data) blocks, finish() to set the
+        final size and close().
+
+        The space of the files with a known size is reserved at once
+        (posix_fallocate) so that they are not fragmented, the small blocks
+        are gathered in a reusable buffer to write big pieces.
+    """
+    def __init__(self, sync=SYNC_NONE, preallocate=True,
+                 buffer_size=BUFFER_SIZE):
+        if sync not in SYNC_POLICIES:
+            raise ValueError('unknown sync policy "%s"' % sync)
+        self.sync = sync
+        self.preallocate = preallocate and hasattr(os, 'posix_fallocate')
+        self._buffer = bytearray(buffer_size)
+        self._view = memoryview(self._buffer)
+        self._fd = None
+        self._used = 0       # bytes in the buffer...
+        self._start = 0      # ...to write at this offset
+        self._pos = 0        # offset of the file descriptor
+        self._end = 0        # size of the file written so far
+        self._finished = False
+
+    def create(self, path, size=0, keep=0):
+        """ Create (or truncate) the file at path and return its fd. With
+            a size, the file is preallocated: not to be given when the file
+            will have holes.
+
+            With keep the existing file is not truncated, its first keep
+            bytes are already right and only what follows is written.
+        """
+        flags = _OPEN_FLAGS & ~os.O_TRUNC if keep else _OPEN_FLAGS
+        self._fd = fd = os.open(path, flags, 0o666)
+        self._used = self._start = self._pos = self._end = 0
+        self._finished = False
+        if keep:
+            self._end = os.fstat(fd).st_size
+        elif size >= PREALLOCATE_MIN and self.preallocate:
+            try:
+                os.posix_fallocate(fd, 0, size)
+                self._end = size
+            except OSError as e:
+                # not supported by the filesystem, only a missed optimization
+                if e.errno not in (errno.EOPNOTSUPP, errno.EINVAL,
+                                   errno.ENOSYS):
+                    self.close()
+                    raise
+        return fd
+
+    def write(self, offset, data):
+        """ Write data at offset in the file """
+        size = len(data)
+        used = self._used
+        if used and (offset != self._start + used or
+                     used + size > len(self._buffer)):
+            self._flush()
+            used = 0
+        if size >= len(self._buffer):
+            self._write_at(offset, data)
+            return
+        if not used:
+            self._start = offset
+        # bytearray, not the view: the data can be a view of another format
+        self._buffer[used:used + size] = data
+        self._used = used + size
+
+    def reflink(self, source):
+        """ Replace the content of the file with the one of source, sharing
+            its data blocks. Raise OSError where the filesystem cannot do
+            it (errno in REFLINK_UNSUPPORTED), the file is left as it is.
+        """
+        try:
+            import fcntl
+        except ImportError:  # not unix
+            raise OSError(errno.ENOSYS, 'reflinks are not supported')
+        src = os.open(source, os.O_RDONLY | getattr(os, 'O_CLOEXEC', 0))
+        try:
+            fcntl.ioctl(self._fd, FICLONE, src)
+            size = os.fstat(src).st_size
+        finally:
+            os.close(src)
+        # what was gathered is replaced as well
+        self._used = 0
+        self._end = size
+
+    @property
+    def flushed(self):
+        """ The data before this offset is written to the file, not
+            waiting in the buffer
+        """
+        return self._start if self._used else self._pos
+
+    def finish(self, size=0):
+        """ Write what is still in the buffer and set the file size (the
+            data can end before it if the file ends with a hole)
+        """
+        self._flush()
+        if self._end != size:  # longer: a kept file that shrinked
+            os.ftruncate(self._fd, size)
+            self._end = size
+        self._finished = True
+
+    def close(self):
+        """ Close the file, syncing it first with the SYNC_FILE policy. A
+            file not finished (an error or a stop) is just closed.
+        """
+        fd, self._fd = self._fd, None
+        if fd is None:
+            return
+        try:
+            if self._finished and self.sync == SYNC_FILE:
+                os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def sync_all(self, destination):
+        """ To be called at the end of the extraction, for SYNC_END """
+        if self.sync == SYNC_END:
+            syncfs(destination)
+
+    def _flush(self):
+        if self._used:
+            self._write_at(self._start, self._view[:self._used])
+            self._used = 0
+
+    def _write_at(self, offset, data):
+        fd = self._fd
+        if offset != self._pos:
+            os.lseek(fd, offset, os.SEEK_SET)
+        size = len(data)
+        written = os.write(fd, data)
+        while written < size:  # short writes are rare, but allowed
+            written += os.write(fd, data[written:])
+        self._pos = offset + size
+        self._end = max(self._end, self._pos)
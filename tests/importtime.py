@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# encoding: utf-8
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+""" Check the import-time budget of the modules epack imports at startup:
+    their cumulative time, measured with `python -X importtime` (python
+    3.7+, median of some runs), must be under the budget, and they must
+    not pull in the modules that are only imported when needed.
+
+    python tests/importtime.py [-n RUNS] [--scale FACTOR]
+
+    The exit code is 1 if a check failed. The budgets are in ms, about
+    twice what a desktop machine takes: --scale them on slow ones.
+"""
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+import os
+import sys
+import argparse
+import subprocess
+
+
+# module: budget (ms)
+BUDGETS = [
+    ('epack.libarchive', 30),
+    ('epack.backend', 20),
+]
+
+# only imported on first use (the library, the backends, python-magic...)
+LAZY = ('ctypes.util', 'subprocess', 'logging', 'multiprocessing', 'magic',
+        'hashlib', 'tempfile')
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure(module):
+    """ Return (cumulative time in ms, names of all the modules imported)
+        of a fresh `import module`
+    """
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    proc = subprocess.Popen([sys.executable, '-X', 'importtime', '-c',
+                             'import ' + module],
+                            stderr=subprocess.PIPE, env=env, cwd=ROOT)
+    err = proc.communicate()[1].decode('utf-8', 'replace')
+    if proc.returncode != 0:
+        raise SystemExit('import %s failed:\n%s' % (module, err))
+    total, names = None, set()
+    for line in err.splitlines():
+        # import time: self [us] | cumulative | imported package
+        fields = line.split('|')
+        if not line.startswith('import time:') or len(fields) != 3 or \
+           not fields[1].strip().isdigit():
+            continue
+        name = fields[2].strip()
+        names.add(name)
+        if name == module:
+            total = int(fields[1]) / 1000.0
+    return total, names
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the import-time '
+                                     'budget of epack')
+    parser.add_argument('-n', '--runs', type=int, default=7,
+                        help='runs for each module, the median is taken')
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help='multiply the budgets by FACTOR')
+    args = parser.parse_args()
+    if sys.version_info < (3, 7):
+        raise SystemExit('python -X importtime needs python 3.7')
+
+    failed = False
+    for module, budget in BUDGETS:
+        times = []
+        for i in range(args.runs):
+            total, names = measure(module)
+            times.append(total)
+        median = sorted(times)[len(times) // 2]
+        budget *= args.scale
+        status = 'ok' if median <= budget else 'OVER BUDGET'
+        print('%-20s %6.1f ms (budget %.0f ms) %s' %
+              (module, median, budget, status))
+        eager = sorted(name for name in names if name in LAZY)
+        if eager:
+            print('%-20s imports %s' % ('', ', '.join(eager)))
+        failed |= median > budget or bool(eager)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# encoding: utf-8
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+import unittest
+
+from epack.extractor import Extractor, ENGINE_PYTHON, ENGINE_DISK
+from epack.matcher import PathMatcher
+
+
+def _add(tar, name, data=None, **attrs):
+    info = tarfile.TarInfo(name)
+    for attr, value in attrs.items():
+        setattr(info, attr, value)
+    if data is None:
+        tar.addfile(info)
+    else:
+        info.size = len(data)
+        tar.addfile(info, io.BytesIO(data))
+
+
+class HardLinkOutsideSelectionTest(unittest.TestCase):
+    """ ./a/f1 is a hard link to ./c/hl, only a/* is extracted: the link
+        is reported as not extracted, the other entries still are
+    """
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.archive = os.path.join(self.tmp, 't.tgz')
+        with tarfile.open(self.archive, 'w:gz') as tar:
+            _add(tar, './c/', type=tarfile.DIRTYPE, mode=0o755)
+            _add(tar, './c/hl', b'hl\n')
+            _add(tar, './a/', type=tarfile.DIRTYPE, mode=0o755)
+            _add(tar, './a/f1', type=tarfile.LNKTYPE, linkname='./c/hl')
+            _add(tar, './a/f2', b'two\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def extract(self, **options):
+        destination = os.path.join(self.tmp, 'out')
+        extractor = Extractor(**options)
+        with self.assertRaises(Exception) as cm:
+            extractor.extract(self.archive, destination,
+                              matcher=PathMatcher(['a/*']))
+        self.assertIn('a/f1', str(cm.exception))
+        self.assertEqual(len(extractor.failed), 1)
+        with open(os.path.join(destination, 'a', 'f2'), 'rb') as f:
+            self.assertEqual(f.read(), b'two\n')
+        self.assertFalse(os.path.exists(os.path.join(destination, 'a', 'f1')))
+        self.assertFalse(os.path.exists(os.path.join(destination, 'c')))
+
+    def test_python_engine(self):
+        self.extract(engine=ENGINE_PYTHON)
+
+    def test_python_engine_pipeline(self):
+        self.extract(engine=ENGINE_PYTHON, pipeline=True)
+
+    def test_disk_engine(self):
+        self.extract(engine=ENGINE_DISK)
+
+
+if __name__ == '__main__':
+    unittest.main()